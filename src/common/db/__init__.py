@@ -9,6 +9,7 @@ from .modules import (
     BlackList,
     BotConfigModule,
     Context,
+    ContextAnswer,
     GroupConfigModule,
     ImageCache,
     Message,
@@ -31,6 +32,7 @@ async def init_db(host: str, port: int, user: str, password: str):
             UserConfigModule,
             Message,
             Context,
+            ContextAnswer,
             BlackList,
             ImageCache,
         ],
@@ -99,12 +99,19 @@ class Context(Document):
     answers: list[Answer] = Field(default_factory=list)
     ban: list[Ban] = Field(default_factory=list)
     clear_time: int = 0
+    # 关键词拼音签名，用于模糊查找；图片等非纯文本的 context 没有
+    pinyin: str | None = None
 
     class Settings:
         name = "context"
         collection = "context"
         indexes = [
             IndexModel([("keywords", pymongo.HASHED)], name="keywords_index"),
+            IndexModel(
+                [("pinyin", pymongo.ASCENDING), ("count", pymongo.DESCENDING)],
+                name="pinyin_index",
+                partialFilterExpression={"pinyin": {"$exists": True}},
+            ),
             IndexModel([("count", pymongo.DESCENDING)], name="count_index"),
             IndexModel([("time", pymongo.DESCENDING)], name="time_index"),
             IndexModel(
@@ -115,6 +122,34 @@ class Context(Document):
         ]
 
 
+class ContextAnswer(Document):
+    """
+    拆分存储时，单独存放的 context 回复，每个群每条回复一个文档
+    """
+
+    context_keywords: str = Field(...)
+    group_id: int = Field(...)
+    keywords: str = Field(...)
+    answer_count: int = Field(default=1, alias="count")
+    time: int = Field(default_factory=lambda: int(time.time()))
+    messages: list[str] = Field(default_factory=list)
+
+    class Settings:
+        name = "answer"
+        collection = "answer"
+        indexes = [
+            IndexModel(
+                [
+                    ("context_keywords", pymongo.ASCENDING),
+                    ("group_id", pymongo.ASCENDING),
+                    ("keywords", pymongo.ASCENDING),
+                ],
+                name="context_group_keywords_index",
+                unique=True,
+            ),
+        ]
+
+
 class BlackList(Document):
     group_id: int = Field(...)
     answers: list[str] = Field(default_factory=list)
@@ -158,6 +193,7 @@ __all__ = [
     "Ban",
     "Answer",
     "Context",
+    "ContextAnswer",
     "BlackList",
     "ImageCache",
 ]
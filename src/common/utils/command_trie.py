@@ -0,0 +1,83 @@
+from collections import deque
+from collections.abc import Iterable
+
+
+class CommandTrie:
+    """
+    命令词的字典树，同时建好 Aho-Corasick 的失配指针
+
+    find_all 扫一遍消息找出出现了哪些词，prefixes 沿树走一遍找出消息以哪些词开头，
+    耗时只和消息长度有关，和注册了多少个词无关
+    """
+
+    __slots__ = ("_fail", "_goto", "_output", "_word")
+
+    def __init__(self, words: Iterable[str]) -> None:
+        self._goto: list[dict[str, int]] = [{}]
+        self._word: list[str | None] = [None]  # 正好在这个节点结束的词
+        for word in words:
+            if word:
+                self._insert(word)
+
+        # 按层建失配指针，顺便把失配链上能匹配的词合并进来，扫描时不用再沿链往回找
+        self._fail = [0] * len(self._goto)
+        self._output: list[tuple[str, ...]] = [() if word is None else (word,) for word in self._word]
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0)
+                self._output[child] += self._output[self._fail[child]]
+                queue.append(child)
+
+    def _insert(self, word: str) -> None:
+        node = 0
+        for ch in word:
+            next_node = self._goto[node].get(ch)
+            if next_node is None:
+                next_node = self._goto[node][ch] = len(self._goto)
+                self._goto.append({})
+                self._word.append(None)
+            node = next_node
+        self._word[node] = word
+
+    def find_all(self, text: str) -> frozenset[str]:
+        """
+        消息里出现了哪些词
+        """
+
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        hits: set[str] = set()
+        node = 0
+        for ch in text:
+            while ch not in goto[node]:
+                if not node:
+                    break
+                node = fail[node]
+            else:
+                node = goto[node][ch]
+                if output[node]:
+                    hits.update(output[node])
+        return frozenset(hits)
+
+    def prefixes(self, text: str) -> list[str]:
+        """
+        消息以哪些词开头，短的在前
+        """
+
+        goto = self._goto
+        words = self._word
+        result = []
+        node = 0
+        for ch in text:
+            node = goto[node].get(ch)
+            if node is None:
+                break
+            if words[node] is not None:
+                result.append(words[node])
+        return result
@@ -0,0 +1,87 @@
+import re
+from typing import NamedTuple
+
+# CQ 码的参数里 ] 会被转义成 &#93;，所以一段 CQ 码就是 [CQ:类型 到下一个 ]
+_CQ_PATTERN = re.compile(r"\[CQ:([a-zA-Z0-9_.-]+)([^\]]*)\]")
+# 图片的 file 以 .image 结尾，后面的 subType 等字段同一张图经常不一样，影响判断
+_IMAGE_SUFFIX = ".image,"
+_IMAGE_PATTERN = re.compile(r"\.image,[^\]]+\]")
+
+
+class CQSegment(NamedTuple):
+    type: str  # 纯文本是 text
+    raw: str  # 规范化之后的原始文本
+
+
+class CQMessage:
+    """
+    一条消息解析成的 CQ 码片段，以及常用的几个特征
+
+    规范化之后的原始文本和各个特征在解析时一次算好，之后各处直接读；片段用到时才切分
+    """
+
+    __slots__ = ("has_at", "has_cq", "has_face", "has_reply", "is_image", "raw")
+
+    def __init__(self, raw: str) -> None:
+        self.raw = raw
+        self.has_cq = "[CQ:" in raw
+        if self.has_cq:
+            # 这几个判断都是在 C 里做的子串查找，比把类型一个个取出来再比较快
+            self.has_face = "[CQ:face," in raw
+            self.is_image = self.has_face or "[CQ:image," in raw  # 图片或者表情
+            self.has_reply = "[CQ:reply," in raw
+            self.has_at = "[CQ:at," in raw
+        else:
+            self.is_image = self.has_face = self.has_reply = self.has_at = False
+
+    @property
+    def is_plain_text(self) -> bool:
+        return not self.has_cq and len(self.raw) != 0
+
+    @property
+    def segments(self) -> list[CQSegment]:
+        if not self.has_cq:
+            return [CQSegment("text", self.raw)] if self.raw else []
+
+        # 切开的结果：[文本, 类型, 参数, 文本, 类型, 参数, ..., 文本]
+        parts = _CQ_PATTERN.split(self.raw)
+        segments = []
+        for i in range(0, len(parts) - 1, 3):
+            if parts[i]:
+                segments.append(CQSegment("text", parts[i]))
+            segments.append(CQSegment(parts[i + 1], f"[CQ:{parts[i + 1]}{parts[i + 2]}]"))
+        if parts[-1]:
+            segments.append(CQSegment("text", parts[-1]))
+        return segments
+
+    def first_cq(self) -> str | None:
+        """
+        第一段 CQ 码的开头，形如 [CQ:image ，没有 CQ 码时返回 None
+        """
+
+        if not self.has_cq:
+            return None
+        match = _CQ_PATTERN.search(self.raw)
+        return f"[CQ:{match.group(1)}" if match else None
+
+
+def parse_cqcode(raw_message: str) -> CQMessage:
+    """
+    解析原始消息，同时去掉图片里会变的字段
+    """
+
+    if "[CQ:" not in raw_message:
+        # 绝大多数消息是纯文本，不用过正则
+        return CQMessage(raw_message)
+
+    if _IMAGE_SUFFIX in raw_message:
+        raw_message = _IMAGE_PATTERN.sub(".image]", raw_message)
+    return CQMessage(raw_message)
+
+
+def normalize_cqcode(raw_message: str) -> str:
+    """
+    规范化之后的原始消息，复读和图片缓存都用这个做比较
+    """
+
+    return parse_cqcode(raw_message).raw
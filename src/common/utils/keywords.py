@@ -0,0 +1,116 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+import pypinyin
+
+try:
+    import jieba_next.analyse as jieba_analyse
+
+    print("Using jieba_next for keywords")
+except ImportError:
+    import jieba.analyse as jieba_analyse
+
+    print("Using jieba for keywords")
+
+
+def to_pinyin(text: str) -> str:
+    return "".join([item[0] for item in pypinyin.pinyin(text, style=pypinyin.NORMAL, errors="default")]).lower()
+
+
+def pinyin_signature(keywords_pinyin: str) -> str:
+    """
+    关键词拼音的签名，不管关键词的先后顺序。同音字、换了顺序的说法签名相同，用于模糊查找 context
+    """
+
+    return " ".join(sorted(keywords_pinyin.split()))
+
+
+def extract_keywords(text: str, top_k: int) -> tuple[list[str], str]:
+    """
+    提取关键词，返回 (关键词列表, 关键词拼音)。提不出关键词时，拼音按原文计算
+    """
+
+    keywords_list = jieba_analyse.extract_tags(text, topK=top_k)
+    return keywords_list, to_pinyin(" ".join(keywords_list) if keywords_list else text)
+
+
+def _extract_keywords_batch(texts: list[str], top_k: int) -> list[tuple[list[str], str]]:
+    return [extract_keywords(text, top_k) for text in texts]
+
+
+class KeywordsExtractor:
+    """
+    在线程池或进程池里提取关键词，不阻塞事件循环
+
+    同一轮事件循环里提交的文本会合并成一批交给线程池；相同的文本直接复用最近的结果
+    """
+
+    def __init__(self, top_k: int, executor: str = "thread", max_workers: int = 1, cache_size: int = 10000) -> None:
+        self.top_k = top_k
+        self.cache_size = cache_size
+        self._executor_type = executor
+        self._max_workers = max_workers
+        self._executor: Executor | None = None
+        self._cache: OrderedDict[str, tuple[list[str], str]] = OrderedDict()
+        # 这一轮还没提交的文本，以及已经提交、还没算完的文本
+        self._batch: dict[str, asyncio.Future] = {}
+        self._running: dict[str, asyncio.Future] = {}
+
+    async def extract(self, text: str) -> tuple[list[str], str]:
+        """
+        提取关键词，返回 (关键词列表, 关键词拼音)
+        """
+
+        if text in self._cache:
+            self._cache.move_to_end(text)
+            return self._cache[text]
+
+        future = self._batch.get(text) or self._running.get(text)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            if not self._batch:
+                loop.call_soon(self._submit_batch)
+            future = self._batch[text] = loop.create_future()
+
+        # 多个消息等同一个结果，不能让其中一个取消影响到别的
+        return await asyncio.shield(future)
+
+    def shutdown(self) -> None:
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self._executor_type == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self._max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="keywords")
+        return self._executor
+
+    def _submit_batch(self) -> None:
+        batch, self._batch = self._batch, {}
+        self._running.update(batch)
+        texts = list(batch)
+
+        loop = asyncio.get_running_loop()
+        batch_future = loop.run_in_executor(self._get_executor(), _extract_keywords_batch, texts, self.top_k)
+
+        def on_done(done: asyncio.Future) -> None:
+            for text in texts:
+                self._running.pop(text, None)
+            if done.cancelled() or done.exception() is not None:
+                error = done.exception() if not done.cancelled() else asyncio.CancelledError()
+                for future in batch.values():
+                    if not future.done():
+                        future.set_exception(error)
+                return
+
+            for text, result in zip(texts, done.result(), strict=True):
+                self._cache[text] = result
+                batch[text].set_result(result)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        batch_future.add_done_callback(on_done)
@@ -1,6 +1,5 @@
 import asyncio
 import base64
-import re
 from datetime import datetime, timedelta
 
 import httpx
@@ -8,10 +7,11 @@ from nonebot.adapters.onebot.v11 import MessageSegment
 
 from src.common.db import ImageCache
 from src.common.utils import HTTPXClient
+from src.common.utils.cqcode import normalize_cqcode
 
 
 async def insert_image(image_seg: MessageSegment):
-    cq_code = re.sub(r"\.image,.+?\]", ".image]", str(image_seg))
+    cq_code = normalize_cqcode(str(image_seg))
     cache = await ImageCache.find_one(ImageCache.cq_code == cq_code)
     if not cache:
         cache = ImageCache(cq_code=cq_code)
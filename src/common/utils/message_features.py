@@ -0,0 +1,144 @@
+from collections.abc import Iterable
+
+from nonebot.adapters.onebot.v11 import GroupMessageEvent
+from nonebot.message import event_preprocessor
+from nonebot.typing import T_State
+
+from .command_trie import CommandTrie
+from .cqcode import CQMessage, parse_cqcode
+
+
+class MessageFeatures:
+    """
+    一条群消息事件的内容特征，在事件预处理时算好放进 state，这个事件的各插件 rule 和处理函数共用
+
+    规范化的原始消息和 CQ 码特征在创建时算好；前缀、命令词这些在事件预处理时算好，各插件的 rule 直接读；
+    关键词由复读插件第一次用到时算好填进来，之后直接复用
+    """
+
+    __slots__ = (
+        "_hits",
+        "_prefixes",
+        "cq",
+        "keywords",
+        "keywords_list",
+        "keywords_pinyin",
+        "plain_text",
+        "text",
+    )
+
+    STATE_KEY = "_message_features"
+
+    # 各插件注册的前缀：前缀 -> [(组名, 在组里的顺序)]，所有组的前缀建在同一棵树里
+    _prefix_owners: dict[str, list[tuple[str, int]]] = {}
+    _prefix_trie = CommandTrie(())
+    # 各插件注册的命令词，建成一个自动机，一条消息扫一遍就知道出现了哪些
+    _keywords: set[str] = set()
+    _keyword_trie = CommandTrie(())
+
+    def __init__(self, raw_message: str, plain_text: str, cq: CQMessage | None = None) -> None:
+        # 删除图片子类型字段，同一张图子类型经常不一样，影响判断
+        self.cq: CQMessage = cq or parse_cqcode(raw_message)
+        self.plain_text = plain_text
+        self.text = plain_text.strip()
+        self.keywords_list: list[str] | None = None
+        self.keywords: str | None = None
+        self.keywords_pinyin: str | None = None
+        self._prefixes: dict[str, str] | None = None
+        self._hits: frozenset[str] | None = None
+
+    @classmethod
+    def of(cls, event: GroupMessageEvent, state: T_State | None = None) -> "MessageFeatures":
+        """
+        取事件预处理时放进 state 的特征，没有的话现算一份，给了 state 就存进去
+        """
+
+        if state is not None and (features := state.get(cls.STATE_KEY)) is not None:
+            return features
+
+        features = cls(event.raw_message, event.get_plaintext())
+        if state is not None:
+            state[cls.STATE_KEY] = features
+        return features
+
+    @classmethod
+    def register_prefixes(cls, name: str, prefixes: Iterable[str]) -> None:
+        """
+        注册一组前缀，比如唱歌的各个歌手名。之后用 prefix(name) 查消息以其中哪个开头
+        """
+
+        for owners in cls._prefix_owners.values():
+            owners[:] = [owner for owner in owners if owner[0] != name]
+        for index, prefix in enumerate(prefixes):
+            cls._prefix_owners.setdefault(prefix, []).append((name, index))
+        cls._prefix_owners = {prefix: owners for prefix, owners in cls._prefix_owners.items() if owners}
+        # 只在插件加载时注册，重建整棵树也没关系
+        cls._prefix_trie = CommandTrie(cls._prefix_owners)
+
+    @classmethod
+    def register_keywords(cls, keywords: Iterable[str]) -> None:
+        """
+        注册命令词，之后用 hits 查消息里出现了哪些
+        """
+
+        cls._keywords.update(keywords)
+        cls._keyword_trie = CommandTrie(cls._keywords)
+
+    @property
+    def raw_message(self) -> str:
+        return self.cq.raw
+
+    @property
+    def is_plain_text(self) -> bool:
+        return not self.cq.has_cq and len(self.plain_text) != 0
+
+    @property
+    def to_me(self) -> bool:
+        return self.plain_text.startswith("牛牛")
+
+    def prefix(self, name: str) -> str | None:
+        """
+        消息以这组前缀里的哪个开头，有多个时取先注册的，都不是时返回 None
+        """
+
+        if self._prefixes is None:
+            self._match_prefixes()
+        return self._prefixes.get(name)  # type: ignore
+
+    @property
+    def hits(self) -> frozenset[str]:
+        if self._hits is None:
+            self._hits = MessageFeatures._keyword_trie.find_all(self.plain_text)
+        return self._hits
+
+    def prepare(self) -> None:
+        """
+        把各插件 rule 要用的特征提前算好
+        """
+
+        if self._prefixes is None:
+            self._match_prefixes()
+        self.hits  # noqa: B018
+
+    def _match_prefixes(self) -> None:
+        # 一般一个都匹配不上，匹配上了也就一两个
+        prefixes: dict[str, str] = {}
+        orders: dict[str, int] = {}
+        for prefix in MessageFeatures._prefix_trie.prefixes(self.plain_text):
+            for name, index in MessageFeatures._prefix_owners[prefix]:
+                if name not in orders or index < orders[name]:
+                    orders[name] = index
+                    prefixes[name] = prefix
+        self._prefixes = prefixes
+
+
+@event_preprocessor
+async def prepare_message_features(event: GroupMessageEvent, state: T_State) -> None:
+    """
+    每个群消息事件只算一遍特征，之后各插件的 rule 都从 state 里读
+    """
+
+    if not isinstance(event, GroupMessageEvent):
+        return
+
+    MessageFeatures.of(event, state).prepare()
@@ -5,10 +5,12 @@ from nonebot.adapters import Bot
 from nonebot.adapters.onebot.v11 import GroupMessageEvent, permission
 from nonebot.plugin import PluginMetadata
 from nonebot.rule import Rule
+from nonebot.typing import T_State
 from ulid import ULID
 
 from src.common.config import BotConfig, GroupConfig, TaskManager
 from src.common.utils import HTTPXClient
+from src.common.utils.message_features import MessageFeatures
 
 from .config import Config
 
@@ -56,11 +58,10 @@ if plugin_config.chat_enable:
         await HTTPXClient.delete(url)
 
 
-async def is_to_chat(event: GroupMessageEvent) -> bool:
+async def is_to_chat(event: GroupMessageEvent, state: T_State) -> bool:
     if plugin_config.chat_enable is False:
         return False
-    text = event.get_plaintext()
-    if not text.startswith("牛牛") and not event.is_tome():
+    if not MessageFeatures.of(event, state).to_me and not event.is_tome():
         return False
     config = BotConfig(event.self_id, event.group_id)
     drunkness = await config.drunkenness()
@@ -7,9 +7,11 @@ from nonebot.adapters.onebot.v11 import GroupMessageEvent, permission
 from nonebot.exception import ActionFailed
 from nonebot.plugin import PluginMetadata
 from nonebot.rule import Rule
+from nonebot.typing import T_State
 from nonebot_plugin_apscheduler import scheduler
 
 from src.common.config import BotConfig
+from src.common.utils.message_features import MessageFeatures
 
 __plugin_meta__ = PluginMetadata(
     name="牛牛喝酒",
@@ -38,8 +40,8 @@ __plugin_meta__ = PluginMetadata(
 driver = get_driver()
 
 
-async def is_drink_msg(event: GroupMessageEvent) -> bool:
-    return event.get_plaintext().strip() in {"牛牛喝酒", "牛牛干杯", "牛牛继续喝"}
+async def is_drink_msg(event: GroupMessageEvent, state: T_State) -> bool:
+    return MessageFeatures.of(event, state).text in {"牛牛喝酒", "牛牛干杯", "牛牛继续喝"}
 
 
 drink_msg = on_message(
@@ -20,6 +20,7 @@ from nonebot.typing import T_State
 
 from src.common.config import BotConfig, GroupConfig, UserConfig
 from src.common.utils import is_bot_admin
+from src.common.utils.message_features import MessageFeatures
 
 from .config import Config
 from .voice import get_random_voice, get_voice_filepath
@@ -52,12 +53,8 @@ greeting_voices = [
 target_msgs = {"牛牛", "帕拉斯"}
 
 
-async def message_equal(event: GroupMessageEvent) -> bool:
-    raw_msg = event.raw_message
-    for target in target_msgs:
-        if target == raw_msg:
-            return True
-    return False
+async def message_equal(event: GroupMessageEvent, state: T_State) -> bool:
+    return MessageFeatures.of(event, state).raw_message in target_msgs
 
 
 call_me_cmd = on_message(
@@ -98,7 +95,7 @@ async def handle_to_me_first_receive(bot: Bot, event: GroupMessageEvent, state:
         return
     await config.refresh_cooldown("to_me")
 
-    if len(event.get_plaintext().strip()) == 0 and not event.reply:
+    if len(MessageFeatures.of(event, state).text) == 0 and not event.reply:
         file_path = get_random_voice(operator, greeting_voices)
         if not file_path:
             await to_me_cmd.finish()
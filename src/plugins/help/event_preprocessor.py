@@ -1,14 +1,13 @@
-from nonebot import get_driver, get_loaded_plugins, logger
+from functools import lru_cache
+
+from nonebot import get_driver, logger
 from nonebot.adapters import Bot
 from nonebot.adapters.onebot.v11 import GroupMessageEvent
 from nonebot.exception import IgnoredException
 from nonebot.internal.matcher import Matcher
 from nonebot.message import event_preprocessor, run_preprocessor
 
-from .plugin_manager import is_plugin_disabled
-
-_blocked_events: dict[str, set[str]] = {}
-
+from .plugin_manager import get_disabled_plugins, lookup_disabled_plugins
 
 IGNORED_PLUGINS = ["help"]
 
@@ -16,7 +15,13 @@ IGNORED_PLUGINS = ["help"]
 def get_plugin_name_from_matcher(matcher: Matcher) -> str:
     """从Matcher对象获取插件名称"""
 
-    module_name = matcher.plugin_name
+    return _plugin_name_of(type(matcher))
+
+
+@lru_cache(maxsize=1024)
+def _plugin_name_of(matcher_type: type[Matcher]) -> str:
+    # 每条消息的每个 matcher 都要算一次，matcher.plugin_name 每次都要去查插件，按 matcher 类缓存起来
+    module_name = matcher_type.plugin_name
     if module_name:
         parts = module_name.split(".")
         for part in reversed(parts):
@@ -29,41 +34,16 @@ def get_plugin_name_from_matcher(matcher: Matcher) -> str:
 @event_preprocessor
 async def block_disabled_plugins(bot: Bot, event: GroupMessageEvent):
     """
-    在事件预处理阶段检查插件是否被禁用
+    在事件预处理阶段加载禁用插件表
+
+    matcher 执行前直接查表，不用按事件记录；这里先把这个 Bot 在这个群的禁用插件加载好，
+    同一优先级的 matcher 是并发执行的，免得表里没有时它们各自去查一遍数据库
     """
 
     if not isinstance(event, GroupMessageEvent):
         return
 
-    event_id = f"{bot.self_id}_{event.message_id}_{event.group_id}"
-
-    # 为每个新事件创建一个空集合
-    _blocked_events[event_id] = set()
-
-    bot_id = int(bot.self_id)
-    group_id = event.group_id
-
-    plugins = get_loaded_plugins()
-
-    for plugin in plugins:
-        if not plugin.name:
-            continue
-
-        plugin_name = plugin.name
-
-        if plugin_name.lower() in IGNORED_PLUGINS:
-            continue
-
-        is_disabled = await is_plugin_disabled(plugin_name, group_id, bot_id)
-
-        if is_disabled:
-            _blocked_events[event_id].add(plugin_name)
-            logger.debug(f"插件 {plugin_name} 在群 {group_id} 对Bot {bot_id} 处于禁用状态")
-
-    if len(_blocked_events) > 10000:
-        keys = list(_blocked_events.keys())
-        for key in keys[:-1000]:
-            _blocked_events.pop(key, None)
+    await get_disabled_plugins(int(bot.self_id), event.group_id)
 
 
 @run_preprocessor
@@ -80,21 +60,16 @@ async def check_plugin_enabled(matcher: Matcher, bot: Bot, event: GroupMessageEv
     if plugin_name.lower() in IGNORED_PLUGINS:
         return
 
-    event_id = f"{bot.self_id}_{event.message_id}_{event.group_id}"
     bot_id = int(bot.self_id)
-    group_id = event.group_id
+    # 预处理时已经加载过了，一般直接查到，不用 await
+    disabled_plugins = lookup_disabled_plugins(bot_id, event.group_id)
+    if disabled_plugins is None:
+        disabled_plugins = await get_disabled_plugins(bot_id, event.group_id)
 
-    if event_id in _blocked_events and plugin_name in _blocked_events[event_id]:
+    if plugin_name in disabled_plugins:
         logger.debug(f"{plugin_name} 已禁用")
         raise IgnoredException(f"Plugin {plugin_name} is disabled")
 
-    # 如果事件ID不在缓存中，直接检查数据库（可能是预处理器没有运行）
-    if event_id not in _blocked_events:
-        is_disabled = await is_plugin_disabled(plugin_name, group_id, bot_id)
-        if is_disabled:
-            logger.debug(f"{plugin_name} 已禁用")
-            raise IgnoredException(f"Plugin {plugin_name} is disabled")
-
 
 driver = get_driver()
 
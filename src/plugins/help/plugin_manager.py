@@ -1,5 +1,6 @@
 import copy
 import shutil
+import time
 from pathlib import Path
 from typing import Any
 
@@ -14,6 +15,14 @@ plugin_config = load_config()
 ignored_plugins = plugin_config.ignored_plugins if plugin_config else []
 CORE_PLUGINS = ["help"]
 
+# 禁用插件表，每条群消息都要查，常驻内存
+# (bot_id, group_id) -> (过期时间, 该账号在该群禁用的插件：全局禁用 + 群禁用)
+# 第一次用到时从数据库加载，修改配置时同步更新；和数据库模型的缓存一样定时过期，别的地方改了数据库也能生效
+DISABLED_TABLE_EXPIRATION = 60
+_disabled_table: dict[tuple[int, int], tuple[float, frozenset[str]]] = {}
+_bot_disabled: dict[int, frozenset[str]] = {}
+_group_disabled: dict[int, frozenset[str]] = {}
+
 
 def clear_help_cache(group_id: int | None = None):
     """清理本地帮助缓存"""
@@ -77,6 +86,48 @@ async def is_plugin_disabled(
         return False
 
 
+def lookup_disabled_plugins(bot_id: int, group_id: int) -> frozenset[str] | None:
+    """
+    只查内存里的禁用插件表，没有或者过期了返回 None，这时再用 get_disabled_plugins 加载
+    """
+    entry = _disabled_table.get((bot_id, group_id))
+    if entry is not None and entry[0] > time.monotonic():
+        return entry[1]
+    return None
+
+
+async def get_disabled_plugins(bot_id: int, group_id: int) -> frozenset[str]:
+    """
+    获取 Bot 在群里禁用的插件，包括全局禁用的
+    """
+    disabled = lookup_disabled_plugins(bot_id, group_id)
+    if disabled is not None:
+        return disabled
+
+    try:
+        bot_config = await BotConfigModule.find_one({"account": bot_id})
+        group_config = await GroupConfigModule.find_one({"group_id": group_id})
+    except Exception as e:
+        logger.error(f"加载Bot {bot_id} 在群 {group_id} 的禁用插件时出错: {str(e)}")
+        # 出错时沿用上次的表，没有的话假设插件都是启用的；到下次过期前不再查，免得数据库出问题时每条消息都去查
+        _bot_disabled.setdefault(bot_id, frozenset())
+        _group_disabled.setdefault(group_id, frozenset())
+        entry = _disabled_table.get((bot_id, group_id))
+        disabled = entry[1] if entry is not None else frozenset()
+        _disabled_table[(bot_id, group_id)] = (time.monotonic() + DISABLED_TABLE_EXPIRATION, disabled)
+        return disabled
+
+    _bot_disabled[bot_id] = frozenset(bot_config.disabled_plugins) if bot_config else frozenset()
+    _group_disabled[group_id] = frozenset(group_config.disabled_plugins) if group_config else frozenset()
+    return _update_disabled_table(bot_id, group_id)
+
+
+def _update_disabled_table(bot_id: int, group_id: int) -> frozenset[str]:
+    disabled = _bot_disabled[bot_id] | _group_disabled[group_id]
+    _disabled_table[(bot_id, group_id)] = (time.monotonic() + DISABLED_TABLE_EXPIRATION, disabled)
+    return disabled
+
+
 async def is_plugin_globally_disabled(plugin_name: str, bot_id: int, ignore_cache: bool = False) -> bool:
     """
     检查插件是否在全局范围内被禁用
@@ -135,6 +186,12 @@ async def update_bot_config(bot_id: int, disabled_plugins: list[str]) -> BotConf
 
     clear_model_cache(BotConfigModule)
 
+    # 同步更新禁用插件表里这个 Bot 的所有群
+    _bot_disabled[bot_id] = frozenset(bot_config.disabled_plugins)
+    for table_bot_id, table_group_id in list(_disabled_table):
+        if table_bot_id == bot_id:
+            _update_disabled_table(table_bot_id, table_group_id)
+
     # 清理所有缓存，因为全局设置影响所有群组
     clear_help_cache()
 
@@ -154,6 +211,12 @@ async def update_group_config(group_id: int, disabled_plugins: list[str]) -> Gro
 
     clear_model_cache(GroupConfigModule)
 
+    # 同步更新禁用插件表里这个群的所有 Bot
+    _group_disabled[group_id] = frozenset(group_config.disabled_plugins)
+    for table_bot_id, table_group_id in list(_disabled_table):
+        if table_group_id == group_id:
+            _update_disabled_table(table_bot_id, table_group_id)
+
     clear_help_cache(group_id)
 
     return group_config
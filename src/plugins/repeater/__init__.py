@@ -1,6 +1,5 @@
 import asyncio
 import random
-import re
 import time
 
 from nonebot import get_bot, get_driver, logger, on_message, on_notice
@@ -9,16 +8,21 @@ from nonebot.adapters.onebot.v11 import GroupMessageEvent, GroupRecallNoticeEven
 from nonebot.exception import ActionFailed
 from nonebot.permission import SUPERUSER, Permission
 from nonebot.plugin import PluginMetadata
-from nonebot.rule import Rule, keyword, to_me
+from nonebot.rule import Rule, to_me
 from nonebot.typing import T_State
 from nonebot_plugin_apscheduler import scheduler
 
 from src.common.config import BotConfig
 from src.common.utils.array2cqcode import try_convert_to_cqcode
+from src.common.utils.cqcode import normalize_cqcode
 from src.common.utils.media_cache import get_image, insert_image
+from src.common.utils.message_features import MessageFeatures
 
+from .context_cache import ContextCache
 from .emoji_reaction import reaction_msg
-from .model import Chat
+from .message_saver import MessageSaver
+from .model import Chat, keywords_extractor
+from .warm_start import WarmStart
 
 __plugin_meta__ = PluginMetadata(
     name="牛牛复读",
@@ -113,11 +117,23 @@ driver = get_driver()
 @driver.on_startup
 async def startup():
     await Chat.update_global_blacklist()
+    WarmStart.start()
+    Chat.resume_clearup()
+
+
+@driver.on_bot_connect
+async def bot_connect(bot: Bot):
+    if bot.self_id.isnumeric():
+        WarmStart.attach_bot(int(bot.self_id))
 
 
 @driver.on_shutdown
 async def shutdown():
+    await WarmStart.stop()
+    await Chat.stop_clearup()
+    await MessageSaver.stop()
     await Chat.sync()
+    keywords_extractor.shutdown()
 
 
 async def is_shutup(self_id: int, group_id: int) -> bool:
@@ -177,7 +193,7 @@ any_msg = on_message(
 
 
 @any_msg.handle()
-async def _(bot: Bot, event: GroupMessageEvent):
+async def _(bot: Bot, event: GroupMessageEvent, state: T_State):
     to_learn = True
     # 多账号登陆，且在同一群中时；避免一条消息被处理多次
     async with message_id_lock:
@@ -194,17 +210,18 @@ async def _(bot: Bot, event: GroupMessageEvent):
         if len(group_message) > 100:
             group_message = group_message[:-10]
 
-    chat: Chat = Chat(event)
+    chat: Chat = Chat(event, state)
 
     answers = None
-    config = BotConfig(event.self_id, event.group_id)
+    config = chat.config
     if await config.is_cooldown("repeat"):
         answers = await chat.answer()
 
     if to_learn:
-        for seg in event.message:
-            if seg.type == "image":
-                await insert_image(seg)
+        if chat.chat_data.is_image:
+            for seg in event.message:
+                if seg.type == "image":
+                    await insert_image(seg)
 
         await chat.learn()
 
@@ -245,8 +262,16 @@ async def is_reply(event: GroupMessageEvent) -> bool:
     return bool(event.reply)
 
 
+BAN_KEYWORD = "不可以"
+MessageFeatures.register_keywords([BAN_KEYWORD])
+
+
+async def is_ban_reply(event: GroupMessageEvent, state: T_State) -> bool:
+    return BAN_KEYWORD in MessageFeatures.of(event, state).hits
+
+
 ban_msg = on_message(
-    rule=to_me() & keyword("不可以") & Rule(is_reply),
+    rule=to_me() & Rule(is_ban_reply, is_reply),
     priority=5,
     block=True,
     permission=IsAdmin,
@@ -258,11 +283,8 @@ async def _(bot: Bot, event: GroupMessageEvent):
     if "[CQ:reply," not in try_convert_to_cqcode(event.raw_message):
         return False
 
-    raw_message = ""
-    for item in event.reply.message:  # type: ignore
-        raw_reply = str(item)
-        # 去掉图片消息中的 url, subType 等字段
-        raw_message += re.sub(r"(\[CQ\:.+)(?:,url=*)(\])", r"\1\2", raw_reply)
+    # 去掉图片消息中的 url, subType 等字段
+    raw_message = normalize_cqcode(str(event.reply.message))  # type: ignore
 
     logger.info(f"bot [{event.self_id}] ready to ban [{raw_message}] in group [{event.group_id}]")
 
@@ -307,12 +329,8 @@ async def _(bot: Bot, event: GroupRecallNoticeEvent, state: T_State):
         logger.warning(f"bot [{event.self_id}] failed to get msg [{event.message_id}]")
         return
 
-    raw_message = ""
-    # 使用get_msg得到的消息不是消息序列，使用正则生成一个迭代对象
-    for item in re.compile(r"\[[^\]]*\]|\w+").findall(try_convert_to_cqcode(msg["message"])):
-        raw_reply = str(item)
-        # 去掉图片消息中的 url, subType 等字段
-        raw_message += re.sub(r"(\[CQ\:.+)(?:,url=*)(\])", r"\1\2", raw_reply)
+    # 使用get_msg得到的消息不是消息序列，先转成 CQ 码，再去掉图片消息中的 url, subType 等字段
+    raw_message = normalize_cqcode(str(try_convert_to_cqcode(msg["message"])))
 
     logger.info(f"bot [{event.self_id}] ready to ban [{raw_message}] in group [{event.group_id}]")
 
@@ -321,7 +339,7 @@ async def _(bot: Bot, event: GroupRecallNoticeEvent, state: T_State):
 
 
 async def message_is_ban(bot: Bot, event: GroupMessageEvent, state: T_State) -> bool:
-    return event.get_plaintext().strip() == "不可以发这个"
+    return MessageFeatures.of(event, state).text == "不可以发这个"
 
 
 ban_msg_latest = on_message(
@@ -355,9 +373,16 @@ async def speak_up():
 
     bot_id, group_id, messages, target_id = ret
 
+    try:
+        bot = get_bot(str(bot_id))
+    except KeyError:
+        # 选好之后账号断开了
+        logger.warning(f"bot [{bot_id}] is not connected, skip speaking to group [{group_id}]")
+        return
+
     for msg in messages:
         logger.info(f"bot [{bot_id}] ready to speak [{msg}] to group [{group_id}]")
-        await get_bot(str(bot_id)).call_api(
+        await bot.call_api(
             "send_group_msg",
             **{
                 "message": msg,
@@ -365,7 +390,7 @@ async def speak_up():
             },
         )
         if target_id:
-            await get_bot(str(bot_id)).call_api(
+            await bot.call_api(
                 "group_poke",
                 **{
                     "user_id": target_id,
@@ -375,6 +400,11 @@ async def speak_up():
         await asyncio.sleep(random.randint(2, 5))
 
 
+@scheduler.scheduled_job("interval", seconds=Chat.CONTEXT_FLUSH_INTERVAL)
+async def flush_context():
+    await ContextCache.flush()
+
+
 @scheduler.scheduled_job("cron", hour=4)
 async def update_data():
     await Chat.sync()
@@ -0,0 +1,254 @@
+import itertools
+import random
+from collections import OrderedDict, defaultdict
+from collections.abc import Collection
+
+from nonebot import get_plugin_config
+
+from src.common.db import Answer, Context
+
+from .config import Config
+from .context_cache import ContextCache
+from .recent_topics import RecentTopics
+
+plugin_config = get_plugin_config(Config)
+
+
+class _Candidate:
+    """
+    合并之后的一条候选回复，各群相同关键词的回复合成一条
+    """
+
+    __slots__ = ("count", "fresh_sample", "keywords", "messages", "weight")
+
+    def __init__(self, answer: Answer) -> None:
+        self.keywords = answer.keywords
+        self.count = answer.count
+        # 只有一条来源时直接引用，不复制
+        self.messages = answer.messages
+        self.weight = 0
+        # 次数很少的回复，如果和别人刚发的一样就不回，这里记下用来比较的那条消息
+        self.fresh_sample: str | None = None
+
+    def merge(self, answer: "Answer | _Candidate") -> None:
+        self.count += answer.count
+        self.messages = self.messages + answer.messages
+
+
+class _AnswerTable:
+    """
+    某个 context 在某个群、某种情况下，静态过滤之后的候选回复和它们的抽样表
+    """
+
+    __slots__ = ("alias", "candidates", "prob", "tokens", "total")
+
+    def __init__(self, candidates: list[_Candidate]) -> None:
+        self.candidates = candidates
+        self.total = 0
+        # 关键词 -> 包含这个词的候选回复下标，一条回复里出现几次就记几次，用来算话题加成
+        self.tokens: defaultdict[str, list[int]] = defaultdict(list)
+        for index, candidate in enumerate(candidates):
+            candidate.weight = min(candidate.count, 10)
+            self.total += candidate.weight
+            if "[CQ:" not in candidate.keywords:
+                for key in candidate.keywords.split(" "):
+                    self.tokens[key].append(index)
+        self.prob, self.alias = self._build_alias([candidate.weight for candidate in candidates])
+
+    @staticmethod
+    def _build_alias(weights: list[int]) -> tuple[list[float], list[int]]:
+        """
+        Vose 别名表，建好之后按权重抽样是 O(1) 的
+        """
+
+        n = len(weights)
+        total = sum(weights)
+        prob = [0.0] * n
+        alias = [0] * n
+        scaled = [weight * n / total for weight in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s = small.pop()
+            g = large.pop()
+            prob[s] = scaled[s]
+            alias[s] = g
+            scaled[g] -= 1 - scaled[s]
+            (small if scaled[g] < 1 else large).append(g)
+        for i in itertools.chain(small, large):
+            prob[i] = 1.0
+        return prob, alias
+
+    def sample(self) -> int:
+        index = random.randrange(len(self.candidates))
+        return index if random.random() < self.prob[index] else self.alias[index]
+
+
+class AnswerEngine:
+    """
+    回复的选择
+
+    回复次数、图片 / 牛牛 / xml / 换行等规则、跨群合并，只取决于 context 和当时的情况（是否喝醉、阈值、
+    是否图片、是否叫了牛牛），按这些算好候选回复和别名表缓存起来；
+    最近回复过的、被 ban 的、别人刚说过的、话题加成这些每次都在变的，在抽样时处理：
+    按 静态权重 + 话题加成 抽一个，命中要排除的就重抽，这样抽到的分布和逐条过滤后加权抽样完全一致。
+    context 学到新回复时，缓存的表作废
+    """
+
+    TOPICS_IMPORTANCE = plugin_config.topics_importance
+    CACHE_SIZE = plugin_config.answer_table_cache_size
+    # 模糊查找时，一个 context 会被各种不同的消息用到，每种消息的关键词各有一张表，最多留这么多张
+    TABLES_PER_CONTEXT = 32
+    # 重抽这么多次还不行，说明大部分候选都被排除了，直接逐条过滤
+    MAX_REJECTIONS = 16
+
+    # context keywords -> (消息的关键词, 群号, 阈值, 是否喝醉, 是否图片, 是否叫了牛牛, 跨群阈值) -> 抽样表
+    _tables: OrderedDict[str, dict[tuple, _AnswerTable | None]] = OrderedDict()
+
+    @classmethod
+    def invalidate(cls, keywords: str) -> None:
+        cls._tables.pop(keywords, None)
+
+    @classmethod
+    def clear(cls) -> None:
+        cls._tables.clear()
+
+    @classmethod
+    async def choose(
+        cls,
+        context: Context,
+        keywords: str,
+        group_id: int,
+        count_threshold: int,
+        is_drunk: bool,
+        is_image: bool,
+        to_me: bool,
+        cross_group_threshold: int,
+        ban_keywords: Collection[str],
+        recent_replies: Collection[str],
+        recent_message: Collection[str],
+        topics: RecentTopics,
+    ) -> tuple[str, list[str]] | None:
+        """
+        选一条回复，返回 (回复的关键词, 回复的原始消息)，没有合适的回复时返回 None
+
+        keywords 是收到的这条消息的关键词，和它一样的回复不选
+        """
+
+        table = await cls._get_table(
+            context, (keywords, group_id, count_threshold, is_drunk, is_image, to_me, cross_group_threshold)
+        )
+        if table is None:
+            return None
+        candidates = table.candidates
+
+        def excluded(candidate: _Candidate) -> bool:
+            return (
+                candidate.keywords in ban_keywords
+                or candidate.keywords in recent_replies
+                or (candidate.fresh_sample is not None and candidate.fresh_sample in recent_message)
+            )
+
+        # 话题加成：每条候选回复里的每个词，在最近的话题里出现了几次
+        topical: defaultdict[int, int] = defaultdict(int)
+        for key, key_count in topics.items():
+            for index in table.tokens.get(key, ()):
+                topical[index] += key_count
+        topical_indexes = list(topical)
+        topical_weights = [topical[index] for index in topical_indexes]
+        topical_total = sum(topical_weights) * cls.TOPICS_IMPORTANCE
+
+        for _ in range(cls.MAX_REJECTIONS):
+            if topical_total and random.random() * (topical_total + table.total) < topical_total:
+                index = random.choices(topical_indexes, weights=topical_weights)[0]
+            else:
+                index = table.sample()
+            candidate = candidates[index]
+            if not excluded(candidate):
+                return candidate.keywords, candidate.messages
+
+        available = [index for index, candidate in enumerate(candidates) if not excluded(candidate)]
+        if not available:
+            return None
+        weights = [candidates[index].weight + topical.get(index, 0) * cls.TOPICS_IMPORTANCE for index in available]
+        candidate = candidates[random.choices(available, weights=weights)[0]]
+        return candidate.keywords, candidate.messages
+
+    @classmethod
+    async def _get_table(cls, context: Context, key: tuple) -> _AnswerTable | None:
+        tables = cls._tables.get(context.keywords)
+        if tables is None:
+            tables = cls._tables[context.keywords] = {}
+            if len(cls._tables) > cls.CACHE_SIZE:
+                cls._tables.popitem(last=False)
+        else:
+            cls._tables.move_to_end(context.keywords)
+            if key in tables:
+                return tables[key]
+
+        keywords, group_id, count_threshold, is_drunk, is_image, to_me, cross_group_threshold = key
+        group_answers, other_answers = await ContextCache.get_answers(context, group_id)
+
+        candidates: dict[str, _Candidate] = {}
+        other_group_cache: dict[str, _Candidate] = {}
+        answers_count = defaultdict(int)
+
+        def candidate_append(dst: dict[str, _Candidate], answer: Answer | _Candidate) -> None:
+            if answer.keywords in dst:
+                dst[answer.keywords].merge(answer)
+            else:
+                dst[answer.keywords] = answer if isinstance(answer, _Candidate) else _Candidate(answer)
+
+        for answer in itertools.chain(group_answers, other_answers):
+            count = answer.count
+            if not is_drunk and count < count_threshold:
+                continue
+
+            answer_key = answer.keywords
+            if answer_key == keywords:
+                continue
+
+            sample_msg = answer.messages[0]
+            if is_image and "[CQ:" not in sample_msg:
+                # 图片消息不回复纯文本。图片经常是表情包，后面的纯文本啥都有，很乱
+                continue
+            if sample_msg.startswith("牛牛"):
+                if not to_me or len(sample_msg) <= 6:
+                    # 这种一般是学反过来的，比如有人教“牛牛你好”——“你好”（反复发了好几次，互为上下文了）
+                    # 然后下次有人发“你好”，突然回个“牛牛你好”，有点莫名其妙的
+                    continue
+            if sample_msg.startswith("[CQ:xml"):
+                continue
+            if "\n" in sample_msg:
+                continue
+
+            if answer.group_id == group_id:
+                candidate_append(candidates, answer)
+            # 别的群的 at, 忽略
+            elif "[CQ:at,qq=" in sample_msg:
+                continue
+            elif is_drunk and count > count_threshold:
+                candidate_append(candidates, answer)
+            else:  # 有这么 N 个群都有相同的回复，就作为全局回复
+                answers_count[answer_key] += 1
+                cur_count = answers_count[answer_key]
+                if cur_count < cross_group_threshold:  # 没达到阈值前，先缓存
+                    candidate_append(other_group_cache, answer)
+                elif cur_count == cross_group_threshold:  # 刚达到阈值时，将缓存加入
+                    if cur_count > 1:
+                        candidate_append(candidates, other_group_cache[answer_key])
+                    candidate_append(candidates, answer)
+                else:  # 超过阈值后，加入
+                    candidate_append(candidates, answer)
+
+        for candidate in candidates.values():
+            if candidate.count < 3:  # 别人刚发的就重复，显得很笨
+                candidate.fresh_sample = candidate.messages[0]
+        table = _AnswerTable(list(candidates.values())) if candidates else None
+
+        # 建表期间 context 可能又学了新回复，那这张表就不缓存了
+        if cls._tables.get(context.keywords) is tables:
+            tables[key] = table
+            if len(tables) > cls.TABLES_PER_CONTEXT:
+                del tables[next(iter(tables))]
+        return table
@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic import BaseModel
 
 
@@ -30,10 +32,46 @@ class Config(BaseModel, extra="ignore"):
     speak_continuously_max_len: int = 2
     # 每隔多久进行一次持久化 ( 秒 )
     save_time_threshold: int = 3600
-    # 单个群超过多少条聊天记录就进行一次持久化，与时间是或的关系
+    # 攒够多少条聊天记录就进行一次持久化，与时间是或的关系，也是每次写入的最大条数
     save_count_threshold: int = 1000
-    # 保存时，给内存中保留的大小
+    # 最多积压多少条还没保存的聊天记录，数据库写不过来时，新消息会等待
+    save_queue_size: int = 20000
+    # 每个群、每个牛牛在内存中保留最近多少条回复，用于 ban 和避免重复回复
     save_reserved_size: int = 100
+    # 每个群在内存中保留最近多少条聊天记录，用于复读、主动发言等
+    message_window_size: int = 1000
+    # 启动时在后台从数据库加载最近多少小时的聊天记录，恢复复读、主动发言等功能，0 为不加载
+    warm_start_hours: int = 24
+    # 关闭时把牛牛的回复记录存到本地，下次启动时恢复
+    reply_snapshot: bool = True
+    # 内存中最多缓存多少条 context
+    context_cache_size: int = 5000
+    # 每隔多久把缓存中修改过的 context 写回数据库 ( 秒 )
+    context_flush_interval: int = 10
+    # 每条回复最多保存多少条原始消息，超过后随机保留
+    answer_messages_max_size: int = 200
+    # context 回复的存储方式，embedded: 回复内嵌在 context 里；split: 回复单独存在 answer 集合里
+    # 从 embedded 切换到 split 前，请先执行 tools/split_context_answers.py 迁移数据
+    context_storage: Literal["embedded", "split"] = "embedded"
+    # split 存储时，别的群的回复每条最多取多少条消息用于跨群回复
+    cross_group_messages_size: int = 10
+    # split 存储时，别的群的回复最多取多少条（按次数从多到少），热门的 context 不用把所有群的回复都加载进来
+    cross_group_answers_size: int = 500
+    # 找不到完全相同的 context 时，按关键词拼音模糊查找同音、换了顺序的说法
+    # 已有的 context 需要先执行 tools/index_context_pinyin.py 补上拼音，新学的会自动带上
+    fuzzy_context: bool = False
+    # 模糊查找最多尝试多少个候选 context，越大越容易有回复，也越慢
+    fuzzy_context_candidates: int = 3
+    # 内存中最多缓存多少条 context 的回复抽样表
+    answer_table_cache_size: int = 2000
+    # 是否有别的进程（比如另一个牛牛实例）也在修改同一个数据库的黑名单，是的话每次保存前先重新加载
+    blacklist_shared: bool = False
+    # 分词在哪里执行，thread: 线程池；process: 进程池，多核机器上消息多时可以试试
+    keywords_executor: Literal["thread", "process"] = "thread"
+    # 分词的线程 / 进程数
+    keywords_workers: int = 1
+    # 最近多少条消息的分词结果缓存起来，复读的消息不用重复分词
+    keywords_cache_size: int = 10000
     # 启用表情回应功能
     enable_reaction: bool = True
     # 启用日常消息一定概率触发表情回应
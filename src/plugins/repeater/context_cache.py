@@ -0,0 +1,520 @@
+import asyncio
+import random
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from beanie import Document
+from nonebot import get_plugin_config, logger
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure, OperationFailure
+
+from src.common.db import Answer, Ban, Context, ContextAnswer
+from src.common.utils.keywords import pinyin_signature, to_pinyin
+
+from .config import Config
+
+plugin_config = get_plugin_config(Config)
+
+# 重试有可能成功的错误码：网络、主从切换、关闭中、超时，以及并发 upsert 撞上唯一索引
+# 其他的（比如文档超过 16MB）重试多少次都一样，直接丢掉出错的那条
+_TRANSIENT_ERROR_CODES = frozenset({
+    6,  # HostUnreachable
+    7,  # HostNotFound
+    89,  # NetworkTimeout
+    91,  # ShutdownInProgress
+    189,  # PrimarySteppedDown
+    262,  # ExceededTimeLimit
+    9001,  # SocketException
+    10107,  # NotWritablePrimary
+    11000,  # DuplicateKey
+    11600,  # InterruptedAtShutdown
+    11602,  # InterruptedDueToReplStateChange
+    13435,  # NotPrimaryNoSecondaryOk
+    13436,  # NotPrimaryOrSecondary
+})
+
+
+@dataclass
+class _PendingAnswer:
+    # 内存里对应的回复，数据库里还没有这条回复时，直接把它整条写进去
+    answer: Answer
+    count: int = 0
+    time: int = 0
+    # 数据库里已经有这条回复时，要追加的消息
+    messages: list[str] = field(default_factory=list)
+    # 数据库里已经有这条回复时，要替换掉的消息，下标 -> 消息
+    replaced: dict[int, str] = field(default_factory=dict)
+
+
+@dataclass
+class _PendingContext:
+    # 有修改没写回的 context 和各群回复，即使被淘汰了也要能拿回来，不然重新加载会丢掉内存里的修改
+    context: Context
+    group_answers: dict[int, list[Answer]] = field(default_factory=dict)
+    create: bool = False
+    count: int = 0
+    time: int = 0
+    answers: dict[tuple[int, str], _PendingAnswer] = field(default_factory=dict)
+    bans: list[dict] = field(default_factory=list)
+
+
+class ContextCache:
+    """
+    热点 context 的进程内缓存
+
+    按 keywords 索引，LRU 淘汰；学习和 ban 直接修改内存里的 context，
+    同时记下对应的原子更新操作，由定时任务和关闭时的 Chat.sync 合并成一次 bulk_write 写回数据库
+
+    split 存储时，context 文档里不再有回复，回复按 (context, 群) 单独加载；
+    别的群的回复只取次数最多的一部分，每条只带少量消息，按 context 共享
+
+    新建的纯文本 context 会带上关键词的拼音签名，find_similar 按签名查同音、换了顺序的 context
+    """
+
+    CACHE_SIZE = plugin_config.context_cache_size
+    ANSWER_MESSAGES_MAX_SIZE = plugin_config.answer_messages_max_size
+    SPLIT_STORAGE = plugin_config.context_storage == "split"
+    CROSS_GROUP_MESSAGES_SIZE = plugin_config.cross_group_messages_size
+    CROSS_GROUP_ANSWERS_SIZE = plugin_config.cross_group_answers_size
+    FUZZY_CANDIDATES = plugin_config.fuzzy_context_candidates
+    # 重试队列最多积压多少条操作、连续失败多少次就放弃，数据库长时间写不进去时不至于无限堆积
+    RETRY_MAX_OPS = 50000
+    RETRY_MAX_ATTEMPTS = 5
+    # 数据库里没有的 context 记多久（秒）。别的进程、重建工具可能会新建它，不能一直当作没有
+    MISS_TTL = 60
+
+    # keywords -> context
+    _cache: OrderedDict[str, Context] = OrderedDict()
+    # 数据库里也没有的 keywords -> 过期时间
+    _misses: OrderedDict[str, float] = OrderedDict()
+    # split 存储时，(keywords, 群号) -> 该群的回复
+    _group_answers: OrderedDict[tuple[str, int], list[Answer]] = OrderedDict()
+    # split 存储时，keywords -> 所有群的回复，只带少量消息
+    _cross_answers: OrderedDict[str, list[Answer]] = OrderedDict()
+    # 拼音签名 -> 签名相同的 context 的 keywords，按触发次数从多到少
+    _similar: OrderedDict[str, list[str]] = OrderedDict()
+    # 还没写回数据库的修改
+    _pending: dict[str, _PendingContext] = {}
+    # 正在写回数据库的修改，写完之前同样要能拿回来
+    _flushing: dict[str, _PendingContext] = {}
+    # 上次写失败、需要重试的操作
+    _retry_ops: dict[type[Document], list[UpdateOne]] = {}
+    # 连续失败的次数
+    _retry_attempts: dict[type[Document], int] = {}
+    _flush_lock = asyncio.Lock()
+
+    @classmethod
+    async def get(cls, keywords: str) -> Context | None:
+        """
+        获取 context，未命中时从数据库加载
+        """
+
+        if keywords in cls._cache:
+            cls._cache.move_to_end(keywords)
+            return cls._cache[keywords]
+
+        pending = cls._pending.get(keywords) or cls._flushing.get(keywords)
+        if pending:
+            context = pending.context
+        else:
+            expire_time = cls._misses.get(keywords)
+            if expire_time is not None and expire_time > time.monotonic():
+                return None
+
+            context = await cls._load(keywords)
+            # 查询期间可能已经有别的消息把它加载（或者新建）了，以那份为准
+            if keywords in cls._cache:
+                cls._cache.move_to_end(keywords)
+                return cls._cache[keywords]
+            if context is None:
+                cls._put(cls._misses, keywords, time.monotonic() + cls.MISS_TTL)
+                return None
+            cls._misses.pop(keywords, None)
+
+        cls._put(cls._cache, keywords, context)
+        return context
+
+    @classmethod
+    async def _load(cls, keywords: str) -> Context | None:
+        if not cls.SPLIT_STORAGE:
+            return await Context.find_one(Context.keywords == keywords)
+
+        # 回复单独加载。迁移时没加 --clear 的话 context 里还留着内嵌的回复，不要读出来
+        doc = await Context.get_pymongo_collection().find_one({"keywords": keywords}, {"answers": 0})
+        return Context.model_validate(doc) if doc else None
+
+    @classmethod
+    async def get_answers(cls, context: Context, group_id: int) -> tuple[list[Answer], list[Answer]]:
+        """
+        获取 context 的回复，返回 (本群的回复, 别的群的回复)
+        """
+
+        if not cls.SPLIT_STORAGE:
+            return (
+                [answer for answer in context.answers if answer.group_id == group_id],
+                [answer for answer in context.answers if answer.group_id != group_id],
+            )
+
+        group_answers = await cls._get_group_answers(context.keywords, group_id)
+
+        keywords = context.keywords
+        if keywords in cls._cross_answers:
+            cls._cross_answers.move_to_end(keywords)
+            cross_answers = cls._cross_answers[keywords]
+        else:
+            # 次数少的回复大多过不了回复阈值，只取次数最多的一部分
+            cursor = (
+                ContextAnswer
+                .get_pymongo_collection()
+                .find(
+                    {"context_keywords": keywords},
+                    # 只取前几条消息，跨群回复用不着那么多
+                    {"_id": 0, "context_keywords": 0, "messages": {"$slice": cls.CROSS_GROUP_MESSAGES_SIZE}},
+                )
+                .sort("count", -1)
+                .limit(cls.CROSS_GROUP_ANSWERS_SIZE)
+            )
+            cross_answers = [Answer.model_validate(doc) async for doc in cursor]
+            cls._put(cls._cross_answers, keywords, cross_answers)
+
+        return group_answers, [answer for answer in cross_answers if answer.group_id != group_id]
+
+    @classmethod
+    def add(cls, keywords: str, cur_time: int) -> Context:
+        """
+        新建一个空的 context，写回时再 upsert 到数据库
+        """
+
+        context = Context(keywords=keywords, time=cur_time, trigger_count=0)  # type: ignore
+        if "[CQ:" not in keywords:
+            context.pinyin = pinyin_signature(to_pinyin(keywords))
+        cls._put(cls._cache, keywords, context)
+        cls._misses.pop(keywords, None)
+        cls._pending_of(context).create = True
+        return context
+
+    @classmethod
+    async def find_similar(cls, keywords: str, signature: str) -> list[str]:
+        """
+        查找拼音签名相同的其他 context，返回它们的 keywords，最多 FUZZY_CANDIDATES 个，触发次数多的在前
+        """
+
+        if signature in cls._similar:
+            cls._similar.move_to_end(signature)
+            candidates = cls._similar[signature]
+        else:
+            candidates = [
+                doc["keywords"]
+                async for doc in Context
+                .get_pymongo_collection()
+                .find({"pinyin": signature}, {"_id": 0, "keywords": 1})
+                .sort("count", -1)
+                # 多取一个，自己也可能在里面
+                .limit(cls.FUZZY_CANDIDATES + 1)
+            ]
+            cls._put(cls._similar, signature, candidates)
+
+        return [candidate for candidate in candidates if candidate != keywords][: cls.FUZZY_CANDIDATES]
+
+    @classmethod
+    async def learn(
+        cls, context: Context, group_id: int, keywords: str, raw_message: str, is_plain_text: bool, cur_time: int
+    ) -> None:
+        """
+        学习一条回复：内存里的 context 直接修改，数据库的修改合并到下一次写回
+        """
+
+        if cls.SPLIT_STORAGE:
+            answers = await cls._get_group_answers(context.keywords, group_id)
+        else:
+            answers = context.answers
+
+        answer = next(
+            (answer for answer in answers if answer.group_id == group_id and answer.keywords == keywords),
+            None,
+        )
+        if answer:
+            answer.count += 1
+            answer.time = cur_time
+        else:
+            answer = Answer(keywords=keywords, group_id=group_id, count=1, time=cur_time, messages=[])
+            answers.append(answer)
+        context.time = cur_time
+        context.trigger_count += 1
+
+        pending_context = cls._pending_of(context)
+        pending_context.count += 1
+        pending_context.time = cur_time
+        if cls.SPLIT_STORAGE:
+            pending_context.group_answers[group_id] = answers
+
+        pending = pending_context.answers.get((group_id, keywords))
+        if pending is None:
+            pending = pending_context.answers[(group_id, keywords)] = _PendingAnswer(answer)
+        pending.count += 1
+        pending.time = cur_time
+
+        # 新学的回复总要记下第一条消息；已有的回复只记纯文本
+        if not is_plain_text and answer.messages:
+            return
+
+        if len(answer.messages) < cls.ANSWER_MESSAGES_MAX_SIZE:
+            answer.messages.append(raw_message)
+            pending.messages.append(raw_message)
+            return
+
+        # 存满了就做蓄水池抽样：第 n 条消息以 max_size / n 的概率随机替换掉一条，
+        # 这样留下来的始终是所有消息的均匀随机样本，random.choice 的分布不变
+        index = random.randrange(answer.count)
+        if index < cls.ANSWER_MESSAGES_MAX_SIZE:
+            answer.messages[index] = raw_message
+            pending.replaced[index] = raw_message
+
+    @classmethod
+    def ban(cls, context: Context, ban: Ban) -> None:
+        """
+        禁止 context 的某条回复
+        """
+
+        context.ban.append(ban)
+        cls._pending_of(context).bans.append(ban.model_dump())
+
+    @classmethod
+    def clear(cls) -> None:
+        """
+        清空缓存，数据库被直接修改过之后调用。还没写回的修改仍会保留
+        """
+
+        cls._cache.clear()
+        cls._misses.clear()
+        cls._group_answers.clear()
+        cls._cross_answers.clear()
+        cls._similar.clear()
+
+    @classmethod
+    async def flush(cls) -> None:
+        """
+        把积累的修改合并成 bulk_write 写回数据库
+        """
+
+        async with cls._flush_lock:
+            if not cls._pending and not cls._retry_ops:
+                return
+
+            cls._flushing, cls._pending = cls._pending, {}
+            retry_ops, cls._retry_ops = cls._retry_ops, {}
+            try:
+                if cls.SPLIT_STORAGE:
+                    ops = {Context: cls._build_split_context_ops(), ContextAnswer: cls._build_split_answer_ops()}
+                else:
+                    ops = {Context: cls._build_embedded_ops()}
+
+                for document_model, model_ops in ops.items():
+                    await cls._bulk_write(document_model, retry_ops.get(document_model, []) + model_ops)
+            finally:
+                # 别的群的回复有变化，下次重新加载；新建的 context 要能被模糊查找找到
+                for keywords, pending in cls._flushing.items():
+                    cls._cross_answers.pop(keywords, None)
+                    if pending.create and pending.context.pinyin:
+                        cls._similar.pop(pending.context.pinyin, None)
+                cls._flushing = {}
+
+    @classmethod
+    async def _bulk_write(cls, document_model: type[Document], ops: list[UpdateOne]) -> None:
+        name = document_model.__name__
+        while ops:
+            try:
+                # 同一个 context 的 upsert 必须在更新它之前执行，所以要按顺序写
+                await document_model.get_pymongo_collection().bulk_write(ops, ordered=True)
+            except BulkWriteError as e:
+                write_errors = e.details.get("writeErrors") or []
+                if not write_errors:
+                    # 只有 write concern 出错，操作都执行了，但不确定有没有同步到从节点，全部重试，计数可能会多加一点
+                    logger.error(f"flush {len(ops)} {name} operations write concern failed: {e}")
+                    cls._retry_later(document_model, ops)
+                    return
+
+                # 顺序写会在第一个出错的地方停下，前面的都已经成功了
+                error = write_errors[0]
+                failed_index = error["index"]
+                if error.get("code") in _TRANSIENT_ERROR_CODES:
+                    logger.warning(f"flush {name} failed at {failed_index}/{len(ops)}, retry later: {error}")
+                    cls._retry_later(document_model, ops[failed_index:])
+                    return
+
+                # 重试也没用，丢掉出错的这条，后面的接着写
+                logger.error(f"flush {name} dropped operation {ops[failed_index]}: {error.get('errmsg')}")
+                ops = ops[failed_index + 1 :]
+            except (ConnectionFailure, OperationFailure) as e:
+                if isinstance(e, OperationFailure) and e.code not in _TRANSIENT_ERROR_CODES:
+                    logger.error(f"flush {len(ops)} {name} operations failed, dropped: {e}")
+                    return
+                # 不知道写进去多少，全部重试，计数可能会多加一点，总比丢了强
+                logger.warning(f"flush {len(ops)} {name} operations failed, retry later: {e}")
+                cls._retry_later(document_model, ops)
+                return
+            except Exception as e:
+                # 编码出错之类的，不知道是哪一条，重试到次数用完为止
+                logger.error(f"flush {len(ops)} {name} operations failed: {e}")
+                cls._retry_later(document_model, ops)
+                return
+            else:
+                break
+
+        cls._retry_attempts.pop(document_model, None)
+
+    @classmethod
+    def _retry_later(cls, document_model: type[Document], ops: list[UpdateOne]) -> None:
+        name = document_model.__name__
+        attempts = cls._retry_attempts.get(document_model, 0) + 1
+        if attempts > cls.RETRY_MAX_ATTEMPTS:
+            logger.error(f"flush {name} failed {attempts - 1} times in a row, dropped {len(ops)} operations")
+            cls._retry_attempts.pop(document_model, None)
+            return
+
+        # 只保留前面的，后面的更新可能依赖前面的 upsert
+        if len(ops) > cls.RETRY_MAX_OPS:
+            logger.error(f"too many {name} operations to retry, dropped the last {len(ops) - cls.RETRY_MAX_OPS}")
+            ops = ops[: cls.RETRY_MAX_OPS]
+        cls._retry_attempts[document_model] = attempts
+        cls._retry_ops[document_model] = ops
+
+    @classmethod
+    def _build_embedded_ops(cls) -> list[UpdateOne]:
+        ops = []
+        for context_keywords, pending in cls._flushing.items():
+            if pending.create:
+                insert = {"time": 0, "count": 0, "answers": [], "ban": [], "clear_time": 0}
+                if pending.context.pinyin:
+                    insert["pinyin"] = pending.context.pinyin
+                ops.append(UpdateOne({"keywords": context_keywords}, {"$setOnInsert": insert}, upsert=True))
+
+            for (group_id, keywords), answer in pending.answers.items():
+                match = {"group_id": group_id, "keywords": keywords}
+                exists = {"keywords": context_keywords, "answers": {"$elemMatch": match}}
+                # 已经有这条回复了，原地累加
+                update = {
+                    "$inc": {"count": answer.count, "answers.$.count": answer.count},
+                    "$set": {"time": answer.time, "answers.$.time": answer.time},
+                }
+                if answer.messages:
+                    update["$push"] = {
+                        "answers.$.messages": {"$each": answer.messages, "$slice": cls.ANSWER_MESSAGES_MAX_SIZE}
+                    }
+                ops.append(UpdateOne(exists, update))
+                # 同一个数组不能在一次更新里既 push 又按下标 set，分开写
+                if answer.replaced:
+                    ops.append(
+                        UpdateOne(
+                            exists,
+                            {"$set": {f"answers.$.messages.{index}": msg for index, msg in answer.replaced.items()}},
+                        )
+                    )
+                # 还没有这条回复，新建一条。和上面的条件互斥，只有一边会生效
+                ops.append(
+                    UpdateOne(
+                        {"keywords": context_keywords, "answers": {"$not": {"$elemMatch": match}}},
+                        {
+                            "$inc": {"count": answer.count},
+                            "$set": {"time": answer.time},
+                            "$push": {
+                                "answers": {
+                                    **match,
+                                    "count": answer.count,
+                                    "time": answer.time,
+                                    "messages": list(answer.answer.messages),
+                                }
+                            },
+                        },
+                    )
+                )
+
+            if pending.bans:
+                ops.append(UpdateOne({"keywords": context_keywords}, {"$push": {"ban": {"$each": pending.bans}}}))
+
+        return ops
+
+    @classmethod
+    def _build_split_context_ops(cls) -> list[UpdateOne]:
+        ops = []
+        for context_keywords, pending in cls._flushing.items():
+            update = {"$setOnInsert": {"answers": [], "clear_time": 0}}
+            if pending.context.pinyin:
+                update["$setOnInsert"]["pinyin"] = pending.context.pinyin
+            if pending.count:
+                update["$inc"] = {"count": pending.count}
+                update["$set"] = {"time": pending.time}
+            else:
+                update["$setOnInsert"] |= {"count": 0, "time": pending.context.time}
+            # 同一个字段不能既 $setOnInsert 又 $push
+            if pending.bans:
+                update["$push"] = {"ban": {"$each": pending.bans}}
+            else:
+                update["$setOnInsert"]["ban"] = []
+            ops.append(UpdateOne({"keywords": context_keywords}, update, upsert=True))
+        return ops
+
+    @classmethod
+    def _build_split_answer_ops(cls) -> list[UpdateOne]:
+        ops = []
+        for context_keywords, pending in cls._flushing.items():
+            for (group_id, keywords), answer in pending.answers.items():
+                key = {"context_keywords": context_keywords, "group_id": group_id, "keywords": keywords}
+                update = {"$inc": {"count": answer.count}, "$set": {"time": answer.time}}
+                if answer.messages:
+                    update["$push"] = {"messages": {"$each": answer.messages, "$slice": cls.ANSWER_MESSAGES_MAX_SIZE}}
+                else:
+                    update["$setOnInsert"] = {"messages": []}
+                ops.append(UpdateOne(key, update, upsert=True))
+                # 新建的回复在上一条里已经插入了，这里两种情况都能直接按下标替换
+                if answer.replaced:
+                    ops.append(
+                        UpdateOne(key, {"$set": {f"messages.{index}": msg for index, msg in answer.replaced.items()}})
+                    )
+        return ops
+
+    @classmethod
+    async def _get_group_answers(cls, keywords: str, group_id: int) -> list[Answer]:
+        key = (keywords, group_id)
+        if key in cls._group_answers:
+            cls._group_answers.move_to_end(key)
+            return cls._group_answers[key]
+
+        for pending_dict in (cls._pending, cls._flushing):
+            pending = pending_dict.get(keywords)
+            if pending and group_id in pending.group_answers:
+                answers = pending.group_answers[group_id]
+                break
+        else:
+            answers = [
+                Answer.model_validate(doc)
+                async for doc in ContextAnswer.get_pymongo_collection().find(
+                    {"context_keywords": keywords, "group_id": group_id}, {"_id": 0, "context_keywords": 0}
+                )
+            ]
+            if key in cls._group_answers:
+                cls._group_answers.move_to_end(key)
+                return cls._group_answers[key]
+
+        cls._put(cls._group_answers, key, answers)
+        return answers
+
+    @classmethod
+    def _pending_of(cls, context: Context) -> _PendingContext:
+        pending = cls._pending.get(context.keywords)
+        if pending is None:
+            pending = cls._pending[context.keywords] = _PendingContext(context)
+            # 正在写回的那份里的各群回复也要带过来，不然写完之后就找不到了
+            flushing = cls._flushing.get(context.keywords)
+            if flushing:
+                pending.group_answers.update(flushing.group_answers)
+        return pending
+
+    @classmethod
+    def _put(cls, cache: OrderedDict, key, value) -> None:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > cls.CACHE_SIZE:
+            # 有修改没写回的仍然保存在 _pending 里，不会丢
+            cache.popitem(last=False)
@@ -10,6 +10,8 @@ from nonebot.typing import T_State
 from nonebot_plugin_alconna import message_reaction
 from nonebot_plugin_apscheduler import scheduler
 
+from src.common.utils.message_features import MessageFeatures
+
 from .config import Config
 
 EMOJI_IDS = (
@@ -273,7 +275,7 @@ async def handle_reaction(bot: Bot, event: GroupMessageEvent):
 
 
 async def has_face(bot: Bot, event: GroupMessageEvent, state: T_State) -> bool:
-    return any(seg.type == "face" for seg in event.message)
+    return MessageFeatures.of(event, state).cq.has_face
 
 
 reaction_msg_with_face = on_message(
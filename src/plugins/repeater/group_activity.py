@@ -0,0 +1,76 @@
+import heapq
+from collections.abc import Iterator
+
+from nonebot import get_plugin_config
+
+from .config import Config
+from .message_window import MessageWindow
+
+plugin_config = get_plugin_config(Config)
+
+
+class GroupActivity:
+    """
+    各群的活跃度统计，用于主动发言的调度
+
+    每来一条消息更新一次该群的统计，并算出下次可以主动发言的时刻：
+    已经超过平均发言间隔 N 倍的时间没有人说话了，才主动发言。
+    所有群按这个时刻放进小顶堆，主动发言时只弹出已经到点的群，不用每次把所有群排序
+    """
+
+    SPEAK_THRESHOLD = plugin_config.speak_threshold
+    BASIC_MSGS_LEN = 10
+    BASIC_DELAY = 600
+
+    # 群号 -> (消息数, 最早一条的时间, 最新一条的时间)
+    _stats: dict[int, tuple[int, int, int]] = {}
+    # (可以主动发言的时刻, 群号)，同一个群可能有过期的旧条目，弹出时跳过
+    _heap: list[tuple[float, int]] = []
+    # 群号 -> 该群在堆里有效条目的时刻，不在堆里的群没有
+    _scheduled: dict[int, float] = {}
+
+    @classmethod
+    def update(cls, group_id: int, window: MessageWindow) -> None:
+        """
+        群里来了新消息，更新统计和调度
+        """
+
+        stats = (len(window), window[0].time, window[-1].time)
+        cls._stats[group_id] = stats
+        if stats[0] < cls.BASIC_MSGS_LEN:
+            return
+
+        due = cls._due_time(stats)
+        scheduled = cls._scheduled.get(group_id)
+        # 时刻推后了不用动，弹出时会重新计算；提前了就得补一个新条目
+        if scheduled is None or due < scheduled:
+            cls._scheduled[group_id] = due
+            heapq.heappush(cls._heap, (due, group_id))
+
+    @classmethod
+    def pop_due(cls, cur_time: float) -> Iterator[int]:
+        """
+        依次弹出已经到了可以主动发言时刻的群。弹出的群直到再有新消息才会重新参与调度
+        """
+
+        heap = cls._heap
+        while heap and heap[0][0] <= cur_time:
+            due, group_id = heapq.heappop(heap)
+            if cls._scheduled.get(group_id) != due:
+                continue
+
+            due = cls._due_time(cls._stats[group_id])
+            if due > cur_time:
+                # 入堆之后又有人说话了，按最新的时刻重新排队
+                cls._scheduled[group_id] = due
+                heapq.heappush(heap, (due, group_id))
+                continue
+
+            del cls._scheduled[group_id]
+            yield group_id
+
+    @classmethod
+    def _due_time(cls, stats: tuple[int, int, int]) -> float:
+        msgs_len, first_time, latest_time = stats
+        avg_interval = (latest_time - first_time) / msgs_len
+        return latest_time + avg_interval * cls.SPEAK_THRESHOLD + cls.BASIC_DELAY
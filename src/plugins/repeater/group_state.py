@@ -0,0 +1,56 @@
+import asyncio
+from collections import defaultdict, deque
+from dataclasses import dataclass
+
+from .message_window import MessageWindow
+from .recent_topics import RecentTopics
+
+
+@dataclass(slots=True)
+class ReplyRecord:
+    """
+    牛牛的一条回复，以及它回复的是哪句话
+    """
+
+    time: int
+    pre_raw_message: str
+    pre_keywords: str
+    reply: str
+    reply_keywords: str
+
+
+class GroupState:
+    """
+    单个群的运行期状态
+
+    各群互不影响，只在事件循环里同步修改的部分不加锁；
+    lock 只用来让同一个群的学习按消息顺序进行，不会挡住别的群
+    """
+
+    __slots__ = ("last_hash", "lock", "messages", "replies", "repeat_count", "speak_history", "topics")
+
+    def __init__(self, window_size: int, topics_size: int, duplicate_reply: int, reply_size: int) -> None:
+        self.messages = MessageWindow(window_size)  # 群消息缓存
+        self.topics = RecentTopics(topics_size)  # 最近聊到的关键词
+        # bot_id -> 牛牛回复的消息缓存，定长，满了挤掉最早的，暂未做持久化
+        self.replies: defaultdict[int, deque[ReplyRecord]] = defaultdict(lambda: deque(maxlen=reply_size))
+        self.speak_history: deque[str] = deque(maxlen=duplicate_reply)  # 主动发言记录，避免重复内容
+        self.lock = asyncio.Lock()
+        # 最近一条消息的哈希，以及它连续出现了几次，用来判断是不是在复读
+        self.last_hash = 0
+        self.repeat_count = 0
+
+    def track_repeat(self, raw_message: str) -> None:
+        message_hash = hash(raw_message)
+        if self.repeat_count and message_hash == self.last_hash:
+            self.repeat_count += 1
+        else:
+            self.last_hash = message_hash
+            self.repeat_count = 1
+
+    def is_repeating(self, raw_message: str, threshold: int) -> bool:
+        """
+        加上这条消息，群里是否已经连续 threshold 条相同的发言了
+        """
+
+        return self.repeat_count >= threshold - 1 and hash(raw_message) == self.last_hash
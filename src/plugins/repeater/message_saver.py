@@ -0,0 +1,159 @@
+import asyncio
+
+from beanie import PydanticObjectId
+from nonebot import get_plugin_config, logger
+from pymongo.errors import BulkWriteError, ConnectionFailure, OperationFailure
+
+from src.common.db import Message as MessageModel
+
+from .config import Config
+from .context_cache import _TRANSIENT_ERROR_CODES
+from .message_window import MessageRecord
+
+plugin_config = get_plugin_config(Config)
+
+
+class MessageSaver:
+    """
+    聊天记录的后台持久化
+
+    消息放进有界队列，由单独的任务攒成批写进数据库，学习消息的协程不再等待写库；
+    数据库慢的时候队列会满，新消息在 put 时等待，不会无限占用内存；
+    网络断开之类的暂时性错误会一直重试，不丢消息，写不进去的消息（比如内容有问题）只丢掉那一条
+    """
+
+    BATCH_SIZE = plugin_config.save_count_threshold
+    SAVE_INTERVAL = plugin_config.save_time_threshold
+    QUEUE_SIZE = plugin_config.save_queue_size
+    RETRY_DELAY_MAX = 60
+    # 关闭时数据库还是写不进去，重试这么多次就放弃，不然关不掉
+    STOP_RETRY_TIMES = 3
+
+    _queue: asyncio.Queue[MessageRecord | None] | None = None
+    _task: asyncio.Task | None = None
+    _stopping = False
+
+    @classmethod
+    async def put(cls, record: MessageRecord) -> None:
+        """
+        放入一条待保存的消息，队列满时等待
+        """
+
+        if cls._stopping:
+            # 已经在关闭了，后台任务不会再从队列里取，直接写
+            await cls._write([record])
+            return
+
+        if cls._queue is None:
+            cls._queue = asyncio.Queue(maxsize=cls.QUEUE_SIZE)
+            cls._task = asyncio.create_task(cls._run())
+        await cls._queue.put(record)
+
+    @classmethod
+    async def stop(cls) -> None:
+        """
+        写完队列里剩下的消息，然后结束后台任务
+        """
+
+        if cls._queue is None or cls._task is None:
+            return
+
+        cls._stopping = True
+        await cls._queue.put(None)
+        await cls._task
+        cls._queue = None
+        cls._task = None
+
+    @classmethod
+    async def _run(cls) -> None:
+        queue = cls._queue
+        assert queue is not None
+        loop = asyncio.get_running_loop()
+
+        stop = False
+        while not stop:
+            record = await queue.get()
+            if record is None:
+                break
+
+            # 攒够一批，或者距离这批第一条消息超过保存间隔，就写一次
+            batch = [record]
+            try:
+                async with asyncio.timeout_at(loop.time() + cls.SAVE_INTERVAL):
+                    while len(batch) < cls.BATCH_SIZE:
+                        record = await queue.get()
+                        if record is None:
+                            stop = True
+                            break
+                        batch.append(record)
+            except TimeoutError:
+                pass
+
+            try:
+                await cls._write(batch)
+            except Exception as e:
+                # 后台任务不能挂，挂了队列满了以后所有学习都会卡住
+                logger.error(f"save messages failed, {len(batch)} messages dropped: {e}")
+
+    @classmethod
+    async def _write(cls, batch: list[MessageRecord]) -> None:
+        models = [record.to_model() for record in batch]
+        # 先在本地分配好 _id，重试时已经写进去的会报重复键，不会多写一份
+        for model in models:
+            model.id = PydanticObjectId()
+        await cls._insert(models)
+
+    @classmethod
+    async def _insert(cls, models: list[MessageModel]) -> None:
+        delay = 1
+        retry_times = 0
+        while models:
+            try:
+                await MessageModel.insert_many(models, ordered=False)
+                return
+            except BulkWriteError as e:
+                errors = {error["index"]: error for error in e.details.get("writeErrors", [])}
+                unacknowledged = bool(e.details.get("writeConcernErrors"))
+                retry = []
+                for index, model in enumerate(models):
+                    write_error = errors.get(index)
+                    code = write_error and write_error.get("code")
+                    if write_error is None:
+                        # 无序插入，没报错的都写进去了；写关注没满足时不确定，再写一次，写过的只会报重复键
+                        if unacknowledged:
+                            retry.append(model)
+                    elif code in _TRANSIENT_ERROR_CODES and code != 11000:
+                        retry.append(model)
+                    elif code != 11000:
+                        # 重试也没用，丢掉这条。重复键说明之前已经写进去了
+                        logger.error(f"save message dropped {model}: {write_error.get('errmsg')}")
+                models = retry
+                error = e
+            except ConnectionFailure as e:
+                # 不知道写进去多少，全部重试，写过的会报重复键
+                error = e
+            except OperationFailure as e:
+                if e.code not in _TRANSIENT_ERROR_CODES:
+                    logger.error(f"save messages failed, {len(models)} messages dropped: {e}")
+                    return
+                error = e
+            except Exception as e:
+                if len(models) == 1:
+                    logger.error(f"save message dropped {models[0]}: {e}")
+                    return
+                # 不是数据库报的错，多半是某条消息编码不了，一条一条写，只丢掉写不了的
+                for model in models:
+                    await cls._insert([model])
+                return
+
+            if not models:
+                return
+
+            retry_times += 1
+            if cls._stopping and retry_times >= cls.STOP_RETRY_TIMES:
+                logger.error(f"save messages failed on shutdown, {len(models)} messages dropped: {error}")
+                return
+
+            logger.warning(f"save messages failed, retry in {delay}s: {error}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, cls.RETRY_DELAY_MAX)
@@ -0,0 +1,65 @@
+from collections import deque
+from collections.abc import Iterator
+from itertools import islice
+
+from src.common.db import Message as MessageModel
+
+
+class MessageRecord:
+    """
+    内存里的一条群消息，比 Message 文档轻得多，同一个对象同时放在群消息窗口和待保存队列里
+    """
+
+    __slots__ = ("bot_id", "group_id", "is_plain_text", "keywords", "plain_text", "raw_message", "time", "user_id")
+
+    def __init__(
+        self,
+        group_id: int,
+        user_id: int,
+        bot_id: int,
+        raw_message: str,
+        is_plain_text: bool,
+        plain_text: str,
+        keywords: str,
+        time: int,
+    ) -> None:
+        self.group_id = group_id
+        self.user_id = user_id
+        self.bot_id = bot_id
+        self.raw_message = raw_message
+        self.is_plain_text = is_plain_text
+        self.plain_text = plain_text
+        self.keywords = keywords
+        self.time = time
+
+    def to_model(self) -> MessageModel:
+        return MessageModel(
+            group_id=self.group_id,
+            user_id=self.user_id,
+            bot_id=self.bot_id,
+            raw_message=self.raw_message,
+            is_plain_text=self.is_plain_text,
+            plain_text=self.plain_text,
+            keywords=self.keywords,
+            time=self.time,
+        )
+
+
+class MessageWindow(deque[MessageRecord]):
+    """
+    单个群最近的消息，定长环形缓冲，满了自动挤掉最早的
+
+    append、首尾访问都是 O(1)，遍历不复制
+    """
+
+    __slots__ = ()
+
+    def __init__(self, maxlen: int) -> None:
+        super().__init__(maxlen=maxlen)
+
+    def last(self, n: int) -> Iterator[MessageRecord]:
+        """
+        最近的 n 条消息，从新到旧
+        """
+
+        return islice(reversed(self), n)
@@ -1,87 +1,147 @@
 import asyncio
+import json
 import random
-import re
 import time
-from collections import defaultdict, deque
+from collections import OrderedDict, defaultdict
 from collections.abc import AsyncGenerator
-from dataclasses import dataclass
-from functools import cached_property, cmp_to_key
+from itertools import islice
+from pathlib import Path
 
-import pypinyin
-from beanie.operators import Or
-from nonebot import get_plugin_config
+from beanie.operators import In
+from bson import ObjectId
+from bson.errors import InvalidId
+from nonebot import get_bots, get_plugin_config, logger
 from nonebot.adapters.onebot.v11 import GroupMessageEvent, Message
+from nonebot.typing import T_State
+from pymongo import UpdateOne
 
 from src.common.config import BotConfig
-from src.common.db import Answer, Ban, Context
-from src.common.db import Message as MessageModel
+from src.common.db import Ban, Context, ContextAnswer
 from src.common.db.modules import BlackList
+from src.common.utils.cqcode import CQMessage, parse_cqcode
+from src.common.utils.keywords import KeywordsExtractor, extract_keywords, pinyin_signature, to_pinyin
+from src.common.utils.message_features import MessageFeatures
 
+from .answer_engine import AnswerEngine
 from .config import Config
+from .context_cache import ContextCache
+from .group_activity import GroupActivity
+from .group_state import GroupState, ReplyRecord
+from .message_saver import MessageSaver
+from .message_window import MessageRecord
 
-try:
-    import jieba_next.analyse as jieba_analyse
+plugin_config = get_plugin_config(Config)
 
-    print("Using jieba_next for repeater")
-except ImportError:
-    import jieba.analyse as jieba_analyse
 
-    print("Using jieba for repeater")
+class ChatData:
+    """
+    复读插件要处理的一条消息
 
+    谁在哪个群、什么时候说的，加上这条消息共用的内容特征。关键词等第一次用到时才算，算好存在特征里，
+    同一个事件在别的插件那里不会再算一遍
+    """
 
-plugin_config = get_plugin_config(Config)
+    __slots__ = ("bot_id", "features", "group_id", "time", "user_id")
 
+    _keywords_size: int = 2
 
-@dataclass
-class ChatData:
-    group_id: int
-    user_id: int
-    raw_message: str
-    plain_text: str
-    time: int
-    bot_id: int
+    def __init__(self, group_id: int, user_id: int, features: MessageFeatures, time: int, bot_id: int) -> None:
+        self.group_id = group_id
+        self.user_id = user_id
+        self.features = features
+        self.time = time
+        self.bot_id = bot_id
 
-    _keywords_size: int = 2
+    @classmethod
+    def from_event(cls, event: GroupMessageEvent, state: T_State | None = None) -> "ChatData":
+        return cls(event.group_id, event.user_id, MessageFeatures.of(event, state), event.time, event.self_id)
 
-    @cached_property
+    @property
+    def raw_message(self) -> str:
+        return self.features.cq.raw
+
+    @property
+    def plain_text(self) -> str:
+        return self.features.plain_text
+
+    @property
+    def cq(self) -> CQMessage:
+        return self.features.cq
+
+    @property
     def is_plain_text(self) -> bool:
-        return "[CQ:" not in self.raw_message and len(self.plain_text) != 0
+        return self.features.is_plain_text
 
-    @cached_property
+    @property
     def is_image(self) -> bool:
-        return "[CQ:image," in self.raw_message or "[CQ:face," in self.raw_message
+        return self.features.cq.is_image
 
-    @cached_property
-    def _keywords_list(self):
-        if not self.is_plain_text and len(self.plain_text) == 0:
-            return []
+    @property
+    def to_me(self) -> bool:
+        return self.features.to_me
 
-        return jieba_analyse.extract_tags(self.plain_text, topK=ChatData._keywords_size)
+    async def prepare(self) -> None:
+        """
+        在线程池里提前算好关键词和拼音，避免分词阻塞事件循环
+        """
+
+        features = self.features
+        if features.keywords_list is not None:
+            return
+
+        if len(features.plain_text) == 0:
+            features.keywords_list = []
+            return
 
-    @cached_property
+        keywords_list, keywords_pinyin = await keywords_extractor.extract(features.plain_text)
+        # 等待期间可能已经被别处算好了
+        if features.keywords_list is None:
+            features.keywords_list = keywords_list
+            features.keywords_pinyin = keywords_pinyin
+
+    @property
+    def keywords_list(self) -> list[str]:
+        features = self.features
+        if features.keywords_list is None:
+            if len(features.plain_text) == 0:
+                features.keywords_list = []
+            else:
+                # 没有提前 prepare 的话，只能在这里同步算了
+                features.keywords_list, features.keywords_pinyin = extract_keywords(
+                    features.plain_text, ChatData._keywords_size
+                )
+        return features.keywords_list
+
+    @property
     def keywords_len(self) -> int:
-        return len(self._keywords_list)
+        return len(self.keywords_list)
 
-    @cached_property
+    @property
     def keywords(self) -> str:
-        if not self.is_plain_text and len(self.plain_text) == 0:
-            return self.raw_message
-
-        if self.keywords_len == 0:
-            return self.plain_text
-        else:
-            # keywords_list.sort()
-            return " ".join(self._keywords_list)  # type: ignore
+        features = self.features
+        if features.keywords is None:
+            if len(features.plain_text) == 0:
+                features.keywords = features.cq.raw
+            elif self.keywords_len == 0:
+                features.keywords = features.plain_text
+            else:
+                features.keywords = " ".join(self.keywords_list)
+        return features.keywords
 
-    @cached_property
+    @property
     def keywords_pinyin(self) -> str:
-        return "".join([
-            item[0] for item in pypinyin.pinyin(self.keywords, style=pypinyin.NORMAL, errors="default")
-        ]).lower()
+        features = self.features
+        if features.keywords_pinyin is None:
+            features.keywords_pinyin = to_pinyin(self.keywords)
+        return features.keywords_pinyin
 
-    @cached_property
-    def to_me(self) -> bool:
-        return self.plain_text.startswith("牛牛")
+
+keywords_extractor = KeywordsExtractor(
+    top_k=ChatData._keywords_size,
+    executor=plugin_config.keywords_executor,
+    max_workers=plugin_config.keywords_workers,
+    cache_size=plugin_config.keywords_cache_size,
+)
 
 
 class Chat:
@@ -105,6 +165,10 @@ class Chat:
     SAVE_TIME_THRESHOLD = plugin_config.save_time_threshold
     SAVE_COUNT_THRESHOLD = plugin_config.save_count_threshold
     SAVE_RESERVED_SIZE = plugin_config.save_reserved_size
+    MESSAGE_WINDOW_SIZE = plugin_config.message_window_size
+    CONTEXT_FLUSH_INTERVAL = plugin_config.context_flush_interval
+    FUZZY_CONTEXT = plugin_config.fuzzy_context
+    BLACKLIST_SHARED = plugin_config.blacklist_shared
 
     # 最好别动的参数
 
@@ -112,43 +176,46 @@ class Chat:
         range(ANSWER_THRESHOLD - len(ANSWER_THRESHOLD_WEIGHTS) + 1, ANSWER_THRESHOLD + 1)
     )
     BLACKLIST_FLAG = 114514
+    CLEARUP_BATCH_SIZE = 1000
+    CLEARUP_CHECKPOINT = Path("data/repeater/clearup_checkpoint.json")
     SPEAK_FLAG = "[PallasBot: Speak]"
     REPLY_FLAG = "[PallasBot: Reply]"
 
     # 运行期变量
 
-    _reply_dict = defaultdict(lambda: defaultdict(list))  # 牛牛回复的消息缓存，暂未做持久化
-    _message_dict: dict[int, list[MessageModel]] = defaultdict(list)  # 群消息缓存
-
-    _reply_lock = asyncio.Lock()  # 回复消息缓存锁
-    _message_lock = asyncio.Lock()
-    _topics_lock = asyncio.Lock()
-
-    _late_save_time = 0  # 上次保存（消息数据持久化）的时刻 ( time.time(), 秒 )
+    # 群号 -> 该群的消息、回复、话题等缓存
+    _groups: dict[int, GroupState] = defaultdict(
+        lambda: GroupState(Chat.MESSAGE_WINDOW_SIZE, Chat.TOPICS_SIZE, Chat.DUPLICATE_REPLY, Chat.SAVE_RESERVED_SIZE)
+    )
 
     _blacklist_answer = defaultdict(set)
     _blacklist_answer_reserve = defaultdict(set)
+    _blacklist_dirty: set[int] = set()  # 上次保存以后黑名单有变化的群
+
+    # 黑名单有变化就加一，下面缓存的 ban 集合版本对不上就重新算
+    _ban_version = 0
+    _group_bans: dict[int, tuple[int, frozenset[str]]] = {}  # 群号 -> 全局 + 本群黑名单
+    # context keywords -> 群号 -> 全局 + 本群黑名单 + 该 context 的 ban
+    _context_bans: OrderedDict[str, dict[int, tuple[int, frozenset[str]]]] = OrderedDict()
 
-    _recent_topics = defaultdict(lambda: deque(maxlen=Chat.TOPICS_SIZE))
-    _recent_speak = defaultdict(lambda: deque(maxlen=Chat.DUPLICATE_REPLY))  # 主动发言记录，避免重复内容
+    # 清理 context 同时只跑一个；启动时接着跑上次没跑完的清理
+    _clearup_lock = asyncio.Lock()
+    _clearup_task: asyncio.Task | None = None
 
     ###
 
-    def __init__(self, data: ChatData | GroupMessageEvent):
-        if isinstance(data, ChatData):
-            self.chat_data = data
-            self.config = BotConfig(data.bot_id, data.group_id)
-        elif isinstance(data, GroupMessageEvent):
-            self.chat_data = ChatData(
-                group_id=data.group_id,
-                user_id=data.user_id,
-                # 删除图片子类型字段，同一张图子类型经常不一样，影响判断
-                raw_message=re.sub(r"\.image,.+?\]", ".image]", data.raw_message),
-                plain_text=data.get_plaintext(),
-                time=data.time,
-                bot_id=data.self_id,
-            )
-            self.config = BotConfig(data.self_id, data.group_id)
+    def __init__(self, data: ChatData | GroupMessageEvent, state: T_State | None = None):
+        if isinstance(data, GroupMessageEvent):
+            data = ChatData.from_event(data, state)
+        self.chat_data = data
+        self._config: BotConfig | None = None
+
+    @property
+    def config(self) -> BotConfig:
+        # 只有回复时要看是否喝醉，用到时才创建
+        if self._config is None:
+            self._config = BotConfig(self.chat_data.bot_id, self.chat_data.group_id)
+        return self._config
 
     async def learn(self) -> bool:
         """
@@ -158,26 +225,27 @@ class Chat:
         if len(self.chat_data.raw_message.strip()) == 0:
             return False
 
-        group_id = self.chat_data.group_id
-        if group_id in Chat._message_dict:
-            group_msgs = Chat._message_dict[group_id]
+        await self.chat_data.prepare()
+
+        state = Chat._groups[self.chat_data.group_id]
+        # 同一个群的消息按顺序学，不然上下文会错位；别的群不受影响
+        async with state.lock:
+            group_msgs = state.messages
             if group_msgs:
                 group_pre_msg = group_msgs[-1]
-            else:
-                group_pre_msg = None
 
-            # 群里的上一条发言
-            await self._context_insert(group_pre_msg)
+                # 群里的上一条发言
+                await self._context_insert(group_pre_msg)
 
-            user_id = self.chat_data.user_id
-            if group_pre_msg and group_pre_msg.user_id != user_id:
-                # 该用户在群里的上一条发言（倒序三句之内）
-                for msg in group_msgs[:-3:-1]:
-                    if msg.user_id == user_id:
-                        await self._context_insert(msg)
-                        break
+                user_id = self.chat_data.user_id
+                if group_pre_msg.user_id != user_id:
+                    # 该用户在群里的上一条发言（倒序三句之内）
+                    for msg in group_msgs.last(2):
+                        if msg.user_id == user_id:
+                            await self._context_insert(msg)
+                            break
 
-        await self._message_insert()
+            await self._message_insert()
         return True
 
     async def answer(self) -> AsyncGenerator[Message, None] | None:
@@ -188,6 +256,8 @@ class Chat:
         if self.chat_data.is_plain_text and len(self.chat_data.plain_text) < 2:
             return None
 
+        await self.chat_data.prepare()
+
         # # 不要一直回复同一个内容
         # if self.chat_data.raw_message == latest_reply['pre_raw_message']:
         #     return None
@@ -199,52 +269,30 @@ class Chat:
         if not results:
             return None
 
-        group_id = self.chat_data.group_id
-        bot_id = self.chat_data.bot_id
-        group_bot_replies = Chat._reply_dict[group_id][bot_id]
+        state = Chat._groups[self.chat_data.group_id]
+        group_bot_replies = state.replies[self.chat_data.bot_id]
 
         raw_message = self.chat_data.raw_message
-        keywords = self.chat_data.keywords
-        async with Chat._reply_lock:
-            group_bot_replies.append({
-                "time": int(time.time()),
-                "pre_raw_message": raw_message,
-                "pre_keywords": keywords,
-                "reply": Chat.REPLY_FLAG,
-                "reply_keywords": Chat.REPLY_FLAG,
-            })
-
-        async def yield_results(results: tuple[list[str], str]) -> AsyncGenerator[Message, None]:
-            answer_list, answer_keywords = results
-            group_bot_replies = Chat._reply_dict[group_id][bot_id]
+        # 模糊查找到的回复，记下实际用到的 context，ban 的时候才能找到
+        answer_list, answer_keywords, context_keywords = results
+        group_bot_replies.append(
+            ReplyRecord(int(time.time()), raw_message, context_keywords, Chat.REPLY_FLAG, Chat.REPLY_FLAG)
+        )
+
+        async def yield_results() -> AsyncGenerator[Message, None]:
             for item in answer_list:
-                async with Chat._reply_lock:
-                    group_bot_replies.append({
-                        "time": int(time.time()),
-                        "pre_raw_message": raw_message,
-                        "pre_keywords": keywords,
-                        "reply": item,
-                        "reply_keywords": answer_keywords,
-                    })
+                group_bot_replies.append(
+                    ReplyRecord(int(time.time()), raw_message, context_keywords, item, answer_keywords)
+                )
+                topics = state.topics
                 if "[CQ:" not in item:
-                    async with Chat._topics_lock:
-                        Chat._recent_topics[group_id] += [
-                            k for k in answer_keywords.split(" ") if not k.startswith("牛牛")
-                        ]
-                async with Chat._topics_lock:
-                    Chat._recent_topics[group_id] += [
-                        k
-                        for k in self.chat_data._keywords_list
-                        if not k.startswith("牛牛")  # type: ignore
-                    ]
+                    topics.extend(k for k in answer_keywords.split(" ") if not k.startswith("牛牛"))
+                topics.extend(k for k in self.chat_data.keywords_list if not k.startswith("牛牛"))
                 # if "[CQ:" not in item and len(item) > Chat.DRUNK_TTS_THRESHOLD and await self.config.drunkenness():
                 #     yield Message(Chat._text_to_speech(item))
                 yield Message(item)
 
-            async with Chat._reply_lock:
-                group_bot_replies = group_bot_replies[-Chat.SAVE_RESERVED_SIZE :]
-
-        return yield_results(results)
+        return yield_results()
 
     @staticmethod
     async def reply_post_proc(raw_message: str, new_msg: str, bot_id: int, group_id: int) -> bool:
@@ -255,11 +303,9 @@ class Chat:
         if raw_message == new_msg:
             return True
 
-        reply_data = Chat._reply_dict[group_id][bot_id][::-1]
-        for item in reply_data:
-            if item["reply"] == raw_message:
-                async with Chat._reply_lock:
-                    item["reply"] = new_msg
+        for item in reversed(Chat._groups[group_id].replies[bot_id]):
+            if item.reply == raw_message:
+                item.reply = new_msg
                 return True
         return False
 
@@ -269,70 +315,37 @@ class Chat:
         主动发言，返回当前最希望发言的 bot 账号、群号、发言消息 List、戳一戳目标，也有可能不发言
         """
 
-        basic_msgs_len = 10
-        basic_delay = 600
-
-        def group_popularity_cmp(lhs: tuple[int, list[MessageModel]], rhs: tuple[int, list[MessageModel]]) -> int:
-            def cmp(a: int | float, b: int | float) -> int:
-                return (a > b) - (a < b)
-
-            lhs_group_id, lhs_msgs = lhs
-            rhs_group_id, rhs_msgs = rhs
-
-            lhs_len = len(lhs_msgs)
-            rhs_len = len(rhs_msgs)
-
-            if lhs_len < basic_msgs_len or rhs_len < basic_msgs_len:
-                return cmp(lhs_len, rhs_len)
-
-            lhs_duration = lhs_msgs[-1].time - lhs_msgs[0].time
-            rhs_duration = rhs_msgs[-1].time - rhs_msgs[0].time
-
-            if not lhs_duration or not rhs_duration:
-                return cmp(lhs_len, rhs_len)
-
-            return cmp(lhs_len / lhs_duration, rhs_len / rhs_duration)
-
-        # 按群聊热度排序
-        popularity = sorted(Chat._message_dict.items(), key=cmp_to_key(group_popularity_cmp))
-
         cur_time = time.time()
-        for group_id, group_msgs in popularity:
-            group_replies = Chat._reply_dict[group_id]
-            if not len(group_replies) or len(group_msgs) < basic_msgs_len:
+        bots = get_bots()
+        # 只看已经超过平均发言间隔 N 倍的时间没有人说话了的群
+        for group_id in GroupActivity.pop_due(cur_time):
+            state = Chat._groups[group_id]
+            group_msgs = state.messages
+            group_replies = state.replies
+            if not len(group_replies):
                 continue
 
             # 一般来说所有牛牛都是一起回复的，最后发言时间应该是一样的，随意随便选一个[0]就好了
             group_replies_front = list(group_replies.values())[0]
-            if not len(group_replies_front) or group_replies_front[-1]["time"] > group_msgs[-1].time:
-                continue
-
-            msgs_len = len(group_msgs)
-            latest_time = group_msgs[-1].time
-            duration = latest_time - group_msgs[0].time
-            avg_interval = duration / msgs_len
-
-            # 已经超过平均发言间隔 N 倍的时间没有人说话了，才主动发言
-            if cur_time - latest_time < avg_interval * Chat.SPEAK_THRESHOLD + basic_delay:
+            if not len(group_replies_front) or group_replies_front[-1].time > group_msgs[-1].time:
                 continue
 
             # append 一个 flag, 防止这个群热度特别高，但压根就没有可用的 context 时，每次 speak 都查这个群，浪费时间
-            async with Chat._reply_lock:
-                group_replies_front.append({
-                    "time": int(cur_time),
-                    "pre_raw_message": Chat.SPEAK_FLAG,
-                    "pre_keywords": Chat.SPEAK_FLAG,
-                    "reply": Chat.SPEAK_FLAG,
-                    "reply_keywords": Chat.SPEAK_FLAG,
-                })
+            group_replies_front.append(
+                ReplyRecord(int(cur_time), Chat.SPEAK_FLAG, Chat.SPEAK_FLAG, Chat.SPEAK_FLAG, Chat.SPEAK_FLAG)
+            )
 
-            bot_id = random.choice([bid for bid in group_replies.keys() if bid])
+            # 只从连着的账号里选，共用数据库的其他实例的账号、已经断开的账号都不行
+            bot_ids = [bid for bid in group_replies.keys() if bid and str(bid) in bots]
+            if not bot_ids:
+                continue
+            bot_id = random.choice(bot_ids)
 
-            ban_keywords = await Chat._find_ban_keywords(context=None, group_id=group_id)
+            ban_keywords = Chat._find_ban_keywords(context=None, group_id=group_id)
 
-            recently = Chat._recent_speak[group_id]
+            recently = state.speak_history
 
-            def msg_filter(msg: MessageModel) -> bool:
+            def msg_filter(msg: MessageRecord) -> bool:
                 cur_raw_message = msg.raw_message
                 cur_keywords = msg.keywords
                 return (
@@ -343,7 +356,7 @@ class Chat:
                     and "\n" not in cur_raw_message
                 )
 
-            available_messages = list(filter(msg_filter, Chat._message_dict[group_id]))
+            available_messages = list(filter(msg_filter, group_msgs))
             if not available_messages:
                 continue
 
@@ -351,16 +364,11 @@ class Chat:
             pretend_msg = list(filter(lambda msg: msg.user_id == taken_name, available_messages))
             first_message = pretend_msg[0] if pretend_msg else available_messages[0]
             speak = first_message.raw_message
-            Chat._recent_speak[group_id].append(speak)
+            recently.append(speak)
 
-            async with Chat._reply_lock:
-                group_replies[bot_id].append({
-                    "time": int(cur_time),
-                    "pre_raw_message": Chat.SPEAK_FLAG,
-                    "pre_keywords": Chat.SPEAK_FLAG,
-                    "reply": speak,
-                    "reply_keywords": Chat.SPEAK_FLAG,
-                })
+            group_replies[bot_id].append(
+                ReplyRecord(int(cur_time), Chat.SPEAK_FLAG, Chat.SPEAK_FLAG, speak, Chat.SPEAK_FLAG)
+            )
 
             speak_list = [
                 Message(speak),
@@ -372,7 +380,9 @@ class Chat:
             ):
                 pre_msg = str(speak_list[-1])
 
-                answer_generator = await Chat(ChatData(group_id, 0, pre_msg, pre_msg, int(cur_time), 0)).answer()
+                answer_generator = await Chat(
+                    ChatData(group_id, 0, MessageFeatures(pre_msg, pre_msg), int(cur_time), 0)
+                ).answer()
                 if not answer_generator:
                     break
 
@@ -384,7 +394,7 @@ class Chat:
 
             target_id = None
             if random.random() < Chat.SPEAK_POKE_PROBABILITY:
-                target_id = random.choice(Chat._message_dict[group_id]).user_id
+                target_id = random.choice(group_msgs).user_id
 
             return (bot_id, group_id, speak_list, target_id)
 
@@ -396,14 +406,14 @@ class Chat:
         禁止以后回复这句话，仅对该群有效果
         """
 
-        if group_id not in Chat._reply_dict:
+        if group_id not in Chat._groups:
             return False
 
         ban_reply = None
-        reply_data = Chat._reply_dict[group_id][bot_id][::-1]
+        reply_data = Chat._groups[group_id].replies[bot_id]
 
-        for reply in reply_data:
-            cur_reply = reply["reply"]
+        for reply in reversed(reply_data):
+            cur_reply = reply.reply
             # 为空时就直接 ban 最后一条回复
             if not ban_raw_message or ban_raw_message in cur_reply:
                 ban_reply = reply
@@ -411,11 +421,10 @@ class Chat:
 
         # 这种情况一般是有些 CQ 码，牛牛发送的时候，和被回复的时候，里面的内容不一样
         if not ban_reply:
-            search = re.search(r"(\[CQ:[a-zA-z0-9-_.]+)", ban_raw_message)
-            if search:
-                type_keyword = search.group(1)
-                for reply in reply_data:
-                    cur_reply = reply["reply"]
+            type_keyword = parse_cqcode(ban_raw_message).first_cq()
+            if type_keyword:
+                for reply in reversed(reply_data):
+                    cur_reply = reply.reply
                     if type_keyword in cur_reply:
                         ban_reply = reply
                         break
@@ -423,95 +432,69 @@ class Chat:
         if not ban_reply:
             return False
 
-        pre_keywords = reply["pre_keywords"]
-        keywords = reply["reply_keywords"]
+        pre_keywords = ban_reply.pre_keywords
+        keywords = ban_reply.reply_keywords
 
-        context_to_ban = await Context.find_one(Context.keywords == pre_keywords)
+        context_to_ban = await ContextCache.get(pre_keywords)
         if context_to_ban:
             ban_reason = Ban(keywords=keywords, group_id=group_id, reason=reason, time=int(time.time()))
-            context_to_ban.ban.append(ban_reason)
-            await context_to_ban.save()
+            ContextCache.ban(context_to_ban, ban_reason)
+            Chat._context_bans.pop(pre_keywords, None)
 
         if keywords in Chat._blacklist_answer_reserve[group_id]:
             Chat._blacklist_answer[group_id].add(keywords)
             if keywords in Chat._blacklist_answer_reserve[Chat.BLACKLIST_FLAG]:
                 Chat._blacklist_answer[Chat.BLACKLIST_FLAG].add(keywords)
+                Chat._blacklist_dirty.add(Chat.BLACKLIST_FLAG)
+            Chat._ban_version += 1
         else:
             Chat._blacklist_answer_reserve[group_id].add(keywords)
+        Chat._blacklist_dirty.add(group_id)
 
         return True
 
     @staticmethod
-    async def get_random_message_from_each_group() -> dict[int, MessageModel]:
+    async def get_random_message_from_each_group() -> dict[int, MessageRecord]:
         """
         获取每个群近期一条随机发言
 
         TODO: 随机权重可以改为 keywords 出现频率 或 用户发言频率 正相关
         """
 
-        return {
-            group_id: random.choice(group_msgs) for group_id, group_msgs in Chat._message_dict.items() if group_msgs
-        }
+        bots = get_bots()
+        result = {}
+        for group_id, state in Chat._groups.items():
+            # 只选连着的账号收到的消息，启动时从数据库加载的消息可能来自其他实例的账号
+            messages = [msg for msg in state.messages if str(msg.bot_id) in bots]
+            if messages:
+                result[group_id] = random.choice(messages)
+        return result
 
     async def _message_insert(self):
         group_id = self.chat_data.group_id
 
-        async with Chat._message_lock:
-            Chat._message_dict[group_id].append(
-                MessageModel(
-                    group_id=group_id,
-                    user_id=self.chat_data.user_id,
-                    bot_id=self.chat_data.bot_id,
-                    raw_message=self.chat_data.raw_message,
-                    is_plain_text=self.chat_data.is_plain_text,
-                    plain_text=self.chat_data.plain_text,
-                    keywords=self.chat_data.keywords,
-                    time=self.chat_data.time,
-                )
-            )
+        record = MessageRecord(
+            group_id=group_id,
+            user_id=self.chat_data.user_id,
+            bot_id=self.chat_data.bot_id,
+            raw_message=self.chat_data.raw_message,
+            is_plain_text=self.chat_data.is_plain_text,
+            plain_text=self.chat_data.plain_text,
+            keywords=self.chat_data.keywords,
+            time=self.chat_data.time,
+        )
+        state = Chat._groups[group_id]
+        state.messages.append(record)
+        state.track_repeat(record.raw_message)
+        GroupActivity.update(group_id, state.messages)
 
         if self.chat_data.is_plain_text:
-            async with Chat._topics_lock:
-                Chat._recent_topics[group_id] += [k for k in self.chat_data._keywords_list if not k.startswith("牛牛")]
+            state.topics.extend(k for k in self.chat_data.keywords_list if not k.startswith("牛牛"))
 
-        cur_time = self.chat_data.time
-        if Chat._late_save_time == 0:
-            Chat._late_save_time = cur_time - 1
-            return
-
-        if len(Chat._message_dict[group_id]) > Chat.SAVE_COUNT_THRESHOLD:
-            await Chat._sync(cur_time)
-
-        elif cur_time - Chat._late_save_time > Chat.SAVE_TIME_THRESHOLD:
-            await Chat._sync(cur_time)
-
-    @staticmethod
-    async def _sync(cur_time: int = int(time.time())):
-        """
-        持久化
-        """
-
-        async with Chat._message_lock:
-            save_list = [
-                msg
-                for group_msgs in Chat._message_dict.values()
-                for msg in group_msgs
-                if msg.time > Chat._late_save_time
-            ]
-            if not save_list:
-                return
-
-            new_dict = {
-                group_id: group_msgs[-Chat.SAVE_RESERVED_SIZE :] for group_id, group_msgs in Chat._message_dict.items()
-            }
-            Chat._message_dict.clear()
-            Chat._message_dict.update(new_dict)
+        # 交给后台任务保存
+        await MessageSaver.put(record)
 
-            Chat._late_save_time = cur_time
-
-        await MessageModel.insert_many(save_list)
-
-    async def _context_insert(self, pre_msg: MessageModel | None):
+    async def _context_insert(self, pre_msg: MessageRecord | None):
         if not pre_msg:
             return
 
@@ -522,7 +505,7 @@ class Chat:
             return
 
         # 回复别人的，不学
-        if "[CQ:reply," in raw_message:
+        if self.chat_data.cq.has_reply:
             return
 
         keywords = self.chat_data.keywords
@@ -530,66 +513,45 @@ class Chat:
         pre_keywords = pre_msg.keywords
         cur_time = self.chat_data.time
 
-        context = await Context.find_one(Context.keywords == pre_keywords)
-        if context:
-            answer_index = next(
-                (
-                    idx
-                    for idx, answer in enumerate(context.answers)
-                    if answer.group_id == group_id and answer.keywords == keywords
-                ),
-                -1,
-            )
-            if answer_index != -1:
-                context.answers[answer_index].count += 1
-                context.answers[answer_index].time = cur_time
-                if self.chat_data.is_plain_text:
-                    context.answers[answer_index].messages.append(raw_message)
-            else:
-                context.answers.append(
-                    Answer(keywords=keywords, group_id=group_id, count=1, time=cur_time, messages=[raw_message])
-                )
-            context.time = cur_time
-            context.trigger_count += 1
-            await context.save()
+        context = await ContextCache.get(pre_keywords)
+        if not context:
+            context = ContextCache.add(pre_keywords, cur_time)
 
-        else:
-            context = Context(
-                keywords=pre_keywords,
-                time=cur_time,
-                trigger_count=1,  # type: ignore
-                answers=[Answer(keywords=keywords, group_id=group_id, count=1, time=cur_time, messages=[raw_message])],
-            )
-            await context.insert()
+        await ContextCache.learn(context, group_id, keywords, raw_message, self.chat_data.is_plain_text, cur_time)
+        AnswerEngine.invalidate(pre_keywords)
+
+    async def _context_find(self) -> tuple[list[str], str, str] | None:
+        """
+        找一条回复，返回 (回复的消息, 回复的 keywords, 用到的 context 的 keywords)
+        """
 
-    async def _context_find(self) -> tuple[list[str], str] | None:
         group_id = self.chat_data.group_id
         raw_message = self.chat_data.raw_message
         keywords = self.chat_data.keywords
         bot_id = self.chat_data.bot_id
 
+        state = Chat._groups[group_id]
+
         # 复读！
-        if group_id in Chat._message_dict:
-            group_msgs = Chat._message_dict[group_id]
-            if len(group_msgs) >= Chat.REPEAT_THRESHOLD and all(
-                item.raw_message == raw_message for item in group_msgs[-Chat.REPEAT_THRESHOLD + 1 :]
-            ):
-                # 到这里说明当前群里是在复读
-                group_bot_replies = Chat._reply_dict[group_id][bot_id]
-                if len(group_bot_replies) and group_bot_replies[-1]["reply"] != raw_message:
-                    return (
-                        [
-                            raw_message,
-                        ],
-                        keywords,
-                    )
-                else:
-                    # 复读过一次就不再回复这句话了
-                    return None
-
-        context = await Context.find_one(Context.keywords == keywords)
+        if len(state.messages) >= Chat.REPEAT_THRESHOLD and state.is_repeating(raw_message, Chat.REPEAT_THRESHOLD):
+            # 到这里说明当前群里是在复读
+            group_bot_replies = state.replies[bot_id]
+            if len(group_bot_replies) and group_bot_replies[-1].reply != raw_message:
+                return (
+                    [
+                        raw_message,
+                    ],
+                    keywords,
+                    keywords,
+                )
+            else:
+                # 复读过一次就不再回复这句话了
+                return None
 
-        if not context:
+        context = await ContextCache.get(keywords)
+        contexts = [context] if context else await self._similar_contexts()
+
+        if not contexts:
             return None
 
         is_drunk = await self.config.drunkenness() > 0
@@ -608,93 +570,61 @@ class Chat:
         else:
             cross_group_threshold = Chat.CROSS_GROUP_THRESHOLD
 
-        ban_keywords = await Chat._find_ban_keywords(context=context, group_id=group_id)
-
-        candidate_answers: dict[str, Answer] = {}
-        other_group_cache = {}
-        answers_count = defaultdict(int)
-        recent_replies = [r["reply_keywords"] for r in Chat._reply_dict[group_id][bot_id][-Chat.DUPLICATE_REPLY :]]
-        recent_message = [m.raw_message for m in Chat._message_dict[group_id][-Chat.DUPLICATE_REPLY :]]
-
-        def candidate_append(dst: dict[str, Answer], answer: Answer):
-            answer_key = answer.keywords
-            if "[CQ:" not in answer_key:
-                topics = Chat._recent_topics[group_id]
-                for key in answer_key.split(" "):
-                    if key in topics:
-                        answer._topical += topics.count(key)
-
-            if answer_key not in dst:
-                dst[answer_key] = answer
-            else:
-                pre_answer = dst[answer_key]
-                pre_answer.count += answer.count
-                pre_answer.messages += answer.messages
-
-        for answer in context.answers:
-            count = answer.count
-            if not is_drunk and count < answer_count_threshold:
-                continue
-
-            answer_key = answer.keywords
-            if answer_key in ban_keywords or answer_key in recent_replies or answer_key == keywords:
-                continue
-
-            sample_msg = answer.messages[0]
-            if self.chat_data.is_image and "[CQ:" not in sample_msg:
-                # 图片消息不回复纯文本。图片经常是表情包，后面的纯文本啥都有，很乱
-                continue
-            if sample_msg.startswith("牛牛"):
-                if not self.chat_data.to_me or len(sample_msg) <= 6:
-                    # 这种一般是学反过来的，比如有人教“牛牛你好”——“你好”（反复发了好几次，互为上下文了）
-                    # 然后下次有人发“你好”，突然回个“牛牛你好”，有点莫名其妙的
-                    continue
-            if sample_msg.startswith("[CQ:xml"):
-                continue
-            if "\n" in sample_msg:
-                continue
-            if count < 3 and sample_msg in recent_message:  # 别人刚发的就重复，显得很笨
-                continue
-
-            if answer.group_id == group_id:
-                candidate_append(candidate_answers, answer)
-            # 别的群的 at, 忽略
-            elif "[CQ:at,qq=" in sample_msg:
-                continue
-            elif is_drunk and count > answer_count_threshold:
-                candidate_append(candidate_answers, answer)
-            else:  # 有这么 N 个群都有相同的回复，就作为全局回复
-                answers_count[answer_key] += 1
-                cur_count = answers_count[answer_key]
-                if cur_count < cross_group_threshold:  # 没达到阈值前，先缓存
-                    candidate_append(other_group_cache, answer)
-                elif cur_count == cross_group_threshold:  # 刚达到阈值时，将缓存加入
-                    if cur_count > 1:
-                        candidate_append(candidate_answers, other_group_cache[answer_key])
-                    candidate_append(candidate_answers, answer)
-                else:  # 超过阈值后，加入
-                    candidate_append(candidate_answers, answer)
-
-        if not candidate_answers:
+        recent_replies = {r.reply_keywords for r in islice(reversed(state.replies[bot_id]), Chat.DUPLICATE_REPLY)}
+        recent_message = {m.raw_message for m in state.messages.last(Chat.DUPLICATE_REPLY)}
+
+        for context in contexts:
+            ban_keywords = Chat._find_ban_keywords(context=context, group_id=group_id)
+            final_answer = await AnswerEngine.choose(
+                context,
+                keywords,
+                group_id,
+                answer_count_threshold,
+                is_drunk,
+                self.chat_data.is_image,
+                self.chat_data.to_me,
+                cross_group_threshold,
+                ban_keywords,
+                recent_replies,
+                recent_message,
+                state.topics,
+            )
+            if final_answer:
+                break
+        else:
             return None
 
-        weights = [
-            min(answer.count, 10) + answer._topical * Chat.TOPICS_IMPORTANCE for answer in candidate_answers.values()
-        ]
-        final_answer = random.choices(list(candidate_answers.values()), weights=weights)[0]
-        answer_str = random.choice(final_answer.messages)
-        answer_keywords = final_answer.keywords
+        answer_keywords, answer_messages = final_answer
+        answer_str = random.choice(answer_messages)
         answer_str = answer_str.removeprefix("牛牛")
 
         if 0 < answer_str.count("，") <= 3 and "[CQ:" not in answer_str and random.random() < Chat.SPLIT_PROBABILITY:
-            return (answer_str.split("，"), answer_keywords)
+            return (answer_str.split("，"), answer_keywords, context.keywords)
         return (
             [
                 answer_str,
             ],
             answer_keywords,
+            context.keywords,
         )
 
+    async def _similar_contexts(self) -> list[Context]:
+        """
+        没有完全相同的 context 时，按拼音签名找几个同音、换了顺序的 context
+        """
+
+        if not Chat.FUZZY_CONTEXT or not self.chat_data.is_plain_text:
+            return []
+
+        keywords = self.chat_data.keywords
+        signature = pinyin_signature(self.chat_data.keywords_pinyin)
+        contexts = []
+        for context_keywords in await ContextCache.find_similar(keywords, signature):
+            context = await ContextCache.get(context_keywords)
+            if context:
+                contexts.append(context)
+        return contexts
+
     @staticmethod
     async def update_global_blacklist() -> None:
         await Chat._select_blacklist()
@@ -707,7 +637,10 @@ class Chat:
                 if keywords_dict[keywords] == Chat.CROSS_GROUP_THRESHOLD:
                     global_blacklist.add(keywords)
 
-        Chat._blacklist_answer[Chat.BLACKLIST_FLAG] |= global_blacklist
+        if not global_blacklist <= Chat._blacklist_answer[Chat.BLACKLIST_FLAG]:
+            Chat._blacklist_answer[Chat.BLACKLIST_FLAG] |= global_blacklist
+            Chat._blacklist_dirty.add(Chat.BLACKLIST_FLAG)
+        Chat._ban_version += 1
 
     @staticmethod
     async def _select_blacklist() -> None:
@@ -719,29 +652,39 @@ class Chat:
                 Chat._blacklist_answer[group_id] |= set(item.answers)
             if item.answers_reserve:
                 Chat._blacklist_answer_reserve[group_id] |= set(item.answers_reserve)
+        Chat._ban_version += 1
 
     @staticmethod
     async def _sync_blacklist() -> None:
-        await Chat._select_blacklist()
+        """
+        只保存有变化的群，所有群合并成一次 bulk_write
+        """
 
-        for group_id, answers in Chat._blacklist_answer.items():
-            if not len(answers):
-                continue
-            await BlackList.find_one(BlackList.group_id == group_id).upsert(
-                {"$set": {"answers": list(answers)}}, on_insert=BlackList(group_id=group_id, answers=list(answers))
+        # 有别的进程也在改黑名单的话，先把它们的修改合并进来，免得被覆盖
+        if Chat.BLACKLIST_SHARED:
+            await Chat._select_blacklist()
+
+        dirty, Chat._blacklist_dirty = Chat._blacklist_dirty, set()
+        ops = []
+        for group_id in dirty:
+            answers = Chat._blacklist_answer[group_id]
+            answers_reserve = Chat._blacklist_answer_reserve[group_id] - answers
+            ops.append(
+                UpdateOne(
+                    {"group_id": group_id},
+                    {"$set": {"answers": list(answers), "answers_reserve": list(answers_reserve)}},
+                    upsert=True,
+                )
             )
+        if not ops:
+            return
 
-        for group_id, answers_set in Chat._blacklist_answer_reserve.items():
-            if not len(answers_set):
-                continue
-            filtered_answers = answers_set
-            if group_id in Chat._blacklist_answer:
-                filtered_answers = answers_set - Chat._blacklist_answer[group_id]
-
-            await BlackList.find_one(BlackList.group_id == group_id).upsert(
-                {"$set": {"answers_reserve": list(filtered_answers)}},
-                on_insert=BlackList(group_id=group_id, answers_reserve=list(filtered_answers)),
-            )
+        try:
+            await BlackList.get_pymongo_collection().bulk_write(ops, ordered=False)
+        except Exception:
+            # 没写进去的下次再写
+            Chat._blacklist_dirty |= dirty
+            raise
 
     @staticmethod
     async def clearup_context() -> None:
@@ -749,43 +692,190 @@ class Chat:
         清理所有超过 15 天没人说、且没有学会的话
         """
 
+        async with Chat._clearup_lock:
+            await Chat._clearup_context()
+
+    @staticmethod
+    def resume_clearup() -> None:
+        """
+        上次的清理没跑完（比如中途重启了），在后台接着跑，不用等到第二天
+        """
+
+        if ContextCache.SPLIT_STORAGE or Chat._load_clearup_checkpoint() is None:
+            return
+
+        def on_done(task: asyncio.Task) -> None:
+            if not task.cancelled() and task.exception() is not None:
+                logger.error(f"resume clearup context failed: {task.exception()}")
+
+        Chat._clearup_task = asyncio.create_task(Chat.clearup_context())
+        Chat._clearup_task.add_done_callback(on_done)
+
+    @staticmethod
+    async def stop_clearup() -> None:
+        # 断点已经存下来了，直接取消，下次启动再接着跑
+        if Chat._clearup_task and not Chat._clearup_task.done():
+            Chat._clearup_task.cancel()
+        Chat._clearup_task = None
+
+    @staticmethod
+    async def _clearup_context() -> None:
         cur_time = int(time.time())
         expiration = cur_time - 15 * 24 * 3600  # 15 天前
 
-        await Context.find(Context.time < expiration, Context.trigger_count < Chat.ANSWER_THRESHOLD).delete()
+        # 直接改数据库，先把缓存里的修改写回去，改完再清掉缓存
+        await ContextCache.flush()
+
+        if ContextCache.SPLIT_STORAGE:
+            await Chat._clearup_split_context(cur_time, expiration)
+            ContextCache.clear()
+            AnswerEngine.clear()
+            return
+
+        # 上次没跑完（比如中途重启了），就沿用上次的时间从断点接着跑
+        last_id = None
+        checkpoint = Chat._load_clearup_checkpoint()
+        if checkpoint:
+            cur_time, expiration, last_id = checkpoint
+        else:
+            await Context.find(Context.time < expiration, Context.trigger_count < Chat.ANSWER_THRESHOLD).delete()
+
+        # 在数据库里直接删掉过期的回复，只把 _id 按顺序流式读出来分批更新，不用把 context 整个加载进内存
+        collection = Context.get_pymongo_collection()
+        query: dict = {"$or": [{"count": {"$gt": 100}}, {"clear_time": {"$lt": expiration}}]}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        update = {
+            "$pull": {"answers": {"count": {"$lte": 1}, "time": {"$lte": expiration}}},
+            "$set": {"clear_time": cur_time},
+        }
 
-        all_context = await Context.find(Or(Context.trigger_count > 100, Context.clear_time < expiration)).to_list()
-        for context in all_context:
-            answers = [ans for ans in context.answers if ans.count > 1 or ans.time > expiration]
-            context.answers = answers
-            context.clear_time = cur_time
-            await context.save()
+        ids = []
+        cursor = collection.find(query, {"_id": 1}, batch_size=Chat.CLEARUP_BATCH_SIZE).sort("_id", 1)
+        async for doc in cursor:
+            ids.append(doc["_id"])
+            if len(ids) >= Chat.CLEARUP_BATCH_SIZE:
+                await collection.update_many({"_id": {"$in": ids}}, update)
+                Chat._save_clearup_checkpoint(cur_time, expiration, ids[-1])
+                ids = []
+        if ids:
+            await collection.update_many({"_id": {"$in": ids}}, update)
+
+        Chat.CLEARUP_CHECKPOINT.unlink(missing_ok=True)
+        ContextCache.clear()
+        AnswerEngine.clear()
 
     @staticmethod
-    async def _find_ban_keywords(context: Context | None, group_id) -> set:
+    def _load_clearup_checkpoint() -> tuple[int, int, ObjectId] | None:
+        if not Chat.CLEARUP_CHECKPOINT.exists():
+            return None
+
+        try:
+            checkpoint = json.loads(Chat.CLEARUP_CHECKPOINT.read_text(encoding="utf-8"))
+            # 断点不管多久以前的都接着跑，过期时间按当时的算，只是少清理一点，下次清理会补上
+            return checkpoint["cur_time"], checkpoint["expiration"], ObjectId(checkpoint["last_id"])
+        except (ValueError, KeyError, TypeError, InvalidId):
+            return None
+
+    @staticmethod
+    def _save_clearup_checkpoint(cur_time: int, expiration: int, last_id: ObjectId) -> None:
+        Chat.CLEARUP_CHECKPOINT.parent.mkdir(parents=True, exist_ok=True)
+        Chat.CLEARUP_CHECKPOINT.write_text(
+            json.dumps({"cur_time": cur_time, "expiration": expiration, "last_id": str(last_id)}),
+            encoding="utf-8",
+        )
+
+    @staticmethod
+    async def _clearup_split_context(cur_time: int, expiration: int) -> None:
+        """
+        split 存储的清理，回复在 answer 集合里，直接在数据库里删
+        """
+
+        expired = {"time": {"$lt": expiration}, "count": {"$lt": Chat.ANSWER_THRESHOLD}}
+        keywords_batch = []
+        async for doc in Context.get_pymongo_collection().find(expired, {"keywords": 1}):
+            keywords_batch.append(doc["keywords"])
+            if len(keywords_batch) >= 1000:
+                await ContextAnswer.find(In(ContextAnswer.context_keywords, keywords_batch)).delete()
+                keywords_batch = []
+        if keywords_batch:
+            await ContextAnswer.find(In(ContextAnswer.context_keywords, keywords_batch)).delete()
+        await Context.get_pymongo_collection().delete_many(expired)
+
+        # 和 embedded 存储一样，只清理触发次数多的、或者很久没清理过的 context 的回复
+        to_clear = {"$or": [{"count": {"$gt": 100}}, {"clear_time": {"$lt": expiration}}]}
+        keywords_batch = []
+        async for doc in Context.get_pymongo_collection().find(
+            to_clear, {"keywords": 1}, batch_size=Chat.CLEARUP_BATCH_SIZE
+        ):
+            keywords_batch.append(doc["keywords"])
+            if len(keywords_batch) >= Chat.CLEARUP_BATCH_SIZE:
+                await Chat._clearup_split_answers(keywords_batch, cur_time, expiration)
+                keywords_batch = []
+        if keywords_batch:
+            await Chat._clearup_split_answers(keywords_batch, cur_time, expiration)
+
+    @staticmethod
+    async def _clearup_split_answers(keywords_batch: list[str], cur_time: int, expiration: int) -> None:
+        await ContextAnswer.find(
+            In(ContextAnswer.context_keywords, keywords_batch),
+            ContextAnswer.answer_count <= 1,
+            ContextAnswer.time <= expiration,
+        ).delete()
+        await Context.find(In(Context.keywords, keywords_batch)).update({"$set": {"clear_time": cur_time}})
+
+    @staticmethod
+    def _find_ban_keywords(context: Context | None, group_id: int) -> frozenset[str]:
         """
         找到在 group_id 群中对应 context 不能回复的关键词
+
+        结果按版本缓存，只在 ban 或者黑名单重新加载后才重新计算，返回的集合不能修改
         """
 
-        # 全局的黑名单
-        ban_keywords = Chat._blacklist_answer[Chat.BLACKLIST_FLAG] | Chat._blacklist_answer[group_id]
+        version = Chat._ban_version
+        cached = Chat._group_bans.get(group_id)
+        if cached is None or cached[0] != version:
+            # 全局的黑名单
+            group_bans = frozenset(Chat._blacklist_answer[Chat.BLACKLIST_FLAG] | Chat._blacklist_answer[group_id])
+            Chat._group_bans[group_id] = (version, group_bans)
+        else:
+            group_bans = cached[1]
+
+        if context is None or not context.ban:
+            return group_bans
+
+        context_bans = Chat._context_bans.get(context.keywords)
+        if context_bans is None:
+            context_bans = {}
+            Chat._context_bans[context.keywords] = context_bans
+            if len(Chat._context_bans) > ContextCache.CACHE_SIZE:
+                Chat._context_bans.popitem(last=False)
+        else:
+            Chat._context_bans.move_to_end(context.keywords)
+            cached = context_bans.get(group_id)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+
         # 针对单条回复的黑名单
-        if context is not None and context.ban:
-            ban_count = defaultdict(int)
-            for ban in context.ban:
-                ban_key = ban.keywords
-                if ban.group_id in {group_id, Chat.BLACKLIST_FLAG}:
+        ban_keywords = set(group_bans)
+        ban_count = defaultdict(int)
+        for ban in context.ban:
+            ban_key = ban.keywords
+            if ban.group_id in {group_id, Chat.BLACKLIST_FLAG}:
+                ban_keywords.add(ban_key)
+            else:
+                # 超过 N 个群都把这句话 ban 了，那就全局 ban 掉
+                ban_count[ban_key] += 1
+                if ban_count[ban_key] == Chat.CROSS_GROUP_THRESHOLD:
                     ban_keywords.add(ban_key)
-                else:
-                    # 超过 N 个群都把这句话 ban 了，那就全局 ban 掉
-                    ban_count[ban_key] += 1
-                    if ban_count[ban_key] == Chat.CROSS_GROUP_THRESHOLD:
-                        ban_keywords.add(ban_key)
-        return ban_keywords
+
+        result = frozenset(ban_keywords)
+        context_bans[group_id] = (version, result)
+        return result
 
     @staticmethod
     async def sync():
-        await Chat._sync()
+        await ContextCache.flush()
         await Chat._sync_blacklist()
 
 
@@ -0,0 +1,47 @@
+from collections import Counter, deque
+from collections.abc import ItemsView, Iterable
+
+
+class RecentTopics:
+    """
+    单个群最近聊到的关键词，定长滑动窗口
+
+    窗口里每个关键词出现了几次单独计数，进出窗口时增减，查询是 O(1) 的。
+    只在事件循环里同步修改，中间没有 await，不需要加锁
+    """
+
+    __slots__ = ("_counter", "_window")
+
+    def __init__(self, maxlen: int) -> None:
+        self._window: deque[str] = deque(maxlen=maxlen)
+        self._counter: Counter[str] = Counter()
+
+    def extend(self, keywords: Iterable[str]) -> None:
+        window = self._window
+        counter = self._counter
+        for key in keywords:
+            if len(window) == window.maxlen:
+                # 最早的关键词马上要被挤出去了
+                old = window[0]
+                if counter[old] == 1:
+                    del counter[old]
+                else:
+                    counter[old] -= 1
+            window.append(key)
+            counter[key] += 1
+
+    def items(self) -> ItemsView[str, int]:
+        """
+        窗口里的每个关键词和它出现的次数
+        """
+
+        return self._counter.items()
+
+    def count(self, key: str) -> int:
+        return self._counter.get(key, 0)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._counter
+
+    def __len__(self) -> int:
+        return len(self._window)
@@ -0,0 +1,185 @@
+import asyncio
+import json
+import math
+import time
+from itertools import starmap
+from pathlib import Path
+
+from nonebot import get_plugin_config, logger
+
+from src.common.db import Message as MessageModel
+
+from .config import Config
+from .group_activity import GroupActivity
+from .group_state import ReplyRecord
+from .message_window import MessageRecord
+from .model import Chat
+
+plugin_config = get_plugin_config(Config)
+
+
+class WarmStart:
+    """
+    重启后恢复运行期状态
+
+    群消息缓存在后台从数据库按时间段从新到旧流式加载，每加载完一段就能用上，不阻塞启动；
+    已经加载满的群，之后的时间段不再查询；
+    牛牛的回复记录没有持久化，关闭时存到本地文件，启动时读回来，等对应的账号连上了再放回去
+    """
+
+    HOURS = plugin_config.warm_start_hours
+    SLICE_SECONDS = 3600
+    BATCH_SIZE = 1000
+    # MessageRecord 用到的字段
+    PROJECTION = {
+        "_id": 0,
+        "group_id": 1,
+        "user_id": 1,
+        "bot_id": 1,
+        "raw_message": 1,
+        "is_plain_text": 1,
+        "plain_text": 1,
+        "keywords": 1,
+        "time": 1,
+    }
+    REPLY_SNAPSHOT = Path("data/repeater/replies.json")
+
+    _task: asyncio.Task | None = None
+    # bot 账号 -> {群号: 回复记录}，还没连上的账号的回复记录
+    _pending_replies: dict[int, dict[int, list[ReplyRecord]]] = {}
+
+    @classmethod
+    def start(cls) -> None:
+        if plugin_config.reply_snapshot:
+            cls._load_replies()
+        if cls.HOURS > 0:
+            cls._task = asyncio.create_task(cls._load_messages())
+            cls._task.add_done_callback(cls._on_done)
+
+    @staticmethod
+    def _on_done(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"repeater warm start failed: {task.exception()}")
+
+    @classmethod
+    async def stop(cls) -> None:
+        if cls._task and not cls._task.done():
+            cls._task.cancel()
+        cls._task = None
+        if plugin_config.reply_snapshot:
+            cls._save_replies()
+
+    @classmethod
+    async def _load_messages(cls) -> None:
+        # 只加载启动之前的消息，之后的消息本来就在缓存里
+        end = int(time.time())
+        slices = [
+            (end - (i + 1) * cls.SLICE_SECONDS, end - i * cls.SLICE_SECONDS)
+            for i in range(math.ceil(cls.HOURS * 3600 / cls.SLICE_SECONDS))
+        ]
+
+        seen: set[int] = set()
+        full: set[int] = set()
+        loaded = 0
+        for begin, slice_end in slices:
+            query: dict = {"time": {"$gte": begin, "$lt": slice_end}}
+            if full:
+                # 已经满了的群不用再下载
+                query["group_id"] = {"$nin": list(full)}
+
+            touched: set[int] = set()
+            cursor = (
+                MessageModel
+                .get_pymongo_collection()
+                .find(query, cls.PROJECTION, batch_size=cls.BATCH_SIZE)
+                .sort("time", -1)
+            )
+            async for doc in cursor:
+                group_id = doc["group_id"]
+                if group_id in full:
+                    continue
+                window = Chat._groups[group_id].messages
+                if len(window) >= (window.maxlen or 0):
+                    full.add(group_id)
+                    continue
+                # 越往后越旧，从左边塞进去，新来的消息照常在右边追加
+                window.appendleft(
+                    MessageRecord(
+                        group_id=group_id,
+                        user_id=doc["user_id"],
+                        bot_id=doc["bot_id"],
+                        raw_message=doc["raw_message"],
+                        is_plain_text=doc.get("is_plain_text", True),
+                        plain_text=doc["plain_text"],
+                        keywords=doc["keywords"],
+                        time=doc["time"],
+                    )
+                )
+                touched.add(group_id)
+                loaded += 1
+
+            for group_id in touched:
+                state = Chat._groups[group_id]
+                GroupActivity.update(group_id, state.messages)
+                # 第一次加载到这个群的时候拿到的就是最新的消息，用来恢复最近的话题和复读状态
+                if group_id not in seen and not len(state.topics):
+                    state.topics.extend(
+                        k
+                        for msg in state.messages
+                        if msg.is_plain_text
+                        for k in msg.keywords.split(" ")
+                        if not k.startswith("牛牛")
+                    )
+                if group_id not in seen and not state.repeat_count:
+                    for msg in state.messages:
+                        state.track_repeat(msg.raw_message)
+            seen |= touched
+
+        logger.info(f"repeater warm start: {loaded} messages of {len(seen)} groups loaded")
+
+    @classmethod
+    def _load_replies(cls) -> None:
+        if not cls.REPLY_SNAPSHOT.exists():
+            return
+
+        try:
+            snapshot = json.loads(cls.REPLY_SNAPSHOT.read_text(encoding="utf-8"))
+            for group_id, bots in snapshot.items():
+                for bot_id, replies in bots.items():
+                    group_replies = cls._pending_replies.setdefault(int(bot_id), {})
+                    group_replies[int(group_id)] = list(starmap(ReplyRecord, replies))
+        except (ValueError, TypeError) as e:
+            logger.warning(f"load reply snapshot failed: {e}")
+
+    @classmethod
+    def attach_bot(cls, bot_id: int) -> None:
+        """
+        账号连上之后再放回它的回复记录，没连上的账号（比如共用数据库的其他实例的）不会被主动发言选中
+        """
+
+        for group_id, replies in cls._pending_replies.pop(bot_id, {}).items():
+            # 连上之前可能已经有新的回复了，旧的放在前面，超出长度时丢掉最旧的
+            current = Chat._groups[group_id].replies[bot_id]
+            merged = [*replies, *current]
+            current.clear()
+            current.extend(merged)
+
+    @classmethod
+    def _save_replies(cls) -> None:
+        def dump(replies) -> list[list]:
+            return [
+                [reply.time, reply.pre_raw_message, reply.pre_keywords, reply.reply, reply.reply_keywords]
+                for reply in replies
+            ]
+
+        snapshot = {
+            group_id: {bot_id: dump(replies) for bot_id, replies in state.replies.items() if replies}
+            for group_id, state in Chat._groups.items()
+            if state.replies
+        }
+        # 这次没连上的账号，回复记录原样留着
+        for bot_id, groups in cls._pending_replies.items():
+            for group_id, replies in groups.items():
+                snapshot.setdefault(group_id, {}).setdefault(bot_id, dump(replies))
+        cls.REPLY_SNAPSHOT.parent.mkdir(parents=True, exist_ok=True)
+        cls.REPLY_SNAPSHOT.write_text(json.dumps(snapshot, ensure_ascii=False), encoding="utf-8")
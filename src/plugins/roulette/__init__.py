@@ -17,8 +17,10 @@ from nonebot.adapters.onebot.v11 import (
 from nonebot.permission import Permission
 from nonebot.plugin import PluginMetadata
 from nonebot.rule import Rule
+from nonebot.typing import T_State
 
 from src.common.config import BotConfig, GroupConfig
+from src.common.utils.message_features import MessageFeatures
 
 __plugin_meta__ = PluginMetadata(
     name="牛牛轮盘",
@@ -184,8 +186,8 @@ async def roulette(messagae_handle, event: GroupMessageEvent):
     )
 
 
-async def is_roulette_type_msg(bot: Bot, event: GroupMessageEvent) -> bool:
-    if event.get_plaintext().strip() in {"牛牛轮盘踢人", "牛牛轮盘禁言", "牛牛踢人轮盘", "牛牛禁言轮盘"}:
+async def is_roulette_type_msg(bot: Bot, event: GroupMessageEvent, state: T_State) -> bool:
+    if MessageFeatures.of(event, state).text in {"牛牛轮盘踢人", "牛牛轮盘禁言", "牛牛踢人轮盘", "牛牛禁言轮盘"}:
         if can_roulette_start(event.group_id):
             if not role_cache[event.self_id][event.group_id]:
                 await sync_role_cache(bot, event)
@@ -221,8 +223,8 @@ async def _(event: GroupMessageEvent):
     await roulette(roulette_type_msg, event)
 
 
-async def is_roulette_msg(bot: Bot, event: GroupMessageEvent) -> bool:
-    if event.get_plaintext().strip() == "牛牛轮盘":
+async def is_roulette_msg(bot: Bot, event: GroupMessageEvent, state: T_State) -> bool:
+    if MessageFeatures.of(event, state).text == "牛牛轮盘":
         if can_roulette_start(event.group_id):
             if not role_cache[event.self_id][event.group_id]:
                 await sync_role_cache(bot, event)
@@ -244,8 +246,8 @@ async def _(event: GroupMessageEvent):
     await roulette(roulette_msg, event)
 
 
-async def is_shot_msg(event: GroupMessageEvent) -> bool:
-    if roulette_status[event.group_id] != 0 and event.get_plaintext().strip() == "牛牛开枪":
+async def is_shot_msg(event: GroupMessageEvent, state: T_State) -> bool:
+    if roulette_status[event.group_id] != 0 and MessageFeatures.of(event, state).text == "牛牛开枪":
         return role_cache[event.self_id][event.group_id] in {"admin", "owner"}
 
     return False
@@ -415,8 +417,9 @@ async def _(bot: Bot, event: GroupRequestEvent):
         await event.approve(bot)
 
 
-async def is_drink_msg(event: GroupMessageEvent) -> bool:
-    if roulette_status[event.group_id] != 0 and event.get_plaintext().strip() in {"牛牛喝酒", "牛牛干杯", "牛牛继续喝"}:
+async def is_drink_msg(event: GroupMessageEvent, state: T_State) -> bool:
+    text = MessageFeatures.of(event, state).text
+    if roulette_status[event.group_id] != 0 and text in {"牛牛喝酒", "牛牛干杯", "牛牛继续喝"}:
         return role_cache[event.self_id][event.group_id] in {"admin", "owner"}
     return False
 
@@ -434,8 +437,8 @@ async def _(event: GroupMessageEvent):
     roulette_player[event.group_id].append(event.user_id)
 
 
-async def is_rescue_msg(event: GroupMessageEvent) -> bool:
-    if event.get_plaintext().strip().startswith("牛牛救一下"):
+async def is_rescue_msg(event: GroupMessageEvent, state: T_State) -> bool:
+    if MessageFeatures.of(event, state).text.startswith("牛牛救一下"):
         return role_cache[event.self_id][event.group_id] in {"admin", "owner"}
     return False
 
@@ -552,8 +555,8 @@ async def _(bot: Bot, event: GroupMessageEvent):
             await rescue_msg.finish("此刻并无需要拯救之人，和平仍在延续。")
 
 
-async def is_judgment_msg(event: GroupMessageEvent) -> bool:
-    if event.get_plaintext().strip().startswith("牛牛补一枪"):
+async def is_judgment_msg(event: GroupMessageEvent, state: T_State) -> bool:
+    if MessageFeatures.of(event, state).text.startswith("牛牛补一枪"):
         return role_cache[event.self_id][event.group_id] in {"admin", "owner"}
     return False
 
@@ -11,6 +11,7 @@ from ulid import ULID
 from src.common.config import GroupConfig, TaskManager
 from src.common.db import SingProgress
 from src.common.utils import HTTPXClient
+from src.common.utils.message_features import MessageFeatures
 
 from .config import Config
 from .ncm_login import get_song_id, get_song_title
@@ -94,31 +95,29 @@ PLAY_COOLDOWN_KEY = "play"
 REQUEST_SONG_COOLDOWN_KEY = "request_song"
 WHAT_SONG_COOLDOWN_KEY = "song_title"
 
+MessageFeatures.register_prefixes("sing_speakers", SPEAKERS)
+MessageFeatures.register_keywords([SING_CMD, REQUEST_SONG_CMD, *SING_CONTINUE_CMDS, *WHAT_SONG_CMDS])
+
 
 async def is_to_sing(event: GroupMessageEvent, state: T_State) -> bool:
     if not plugin_config.sing_enable:
         return False
-    text = event.get_plaintext()
+    features = MessageFeatures.of(event, state)
+    text = features.plain_text
     if not text:
         return False
 
-    if SING_CMD not in text and not any(cmd in text for cmd in SING_CONTINUE_CMDS):
+    if SING_CMD not in features.hits and features.hits.isdisjoint(SING_CONTINUE_CMDS):
         return False
 
     if text.endswith(SING_CMD):
         return False
 
-    has_spk = False
-    for name, speaker in plugin_config.sing_speakers.items():
-        if not text.startswith(name):
-            continue
-        text = text.replace(name, "").strip()
-        has_spk = True
-        state["speaker"] = speaker
-        break
-
-    if not has_spk:
+    name = features.prefix("sing_speakers")
+    if name is None:
         return False
+    text = text.replace(name, "").strip()
+    state["speaker"] = plugin_config.sing_speakers[name]
 
     if "key=" in text:
         key_pos = text.find("key=")
@@ -220,18 +219,16 @@ async def _(bot: Bot, event: GroupMessageEvent, state: T_State):
     await sing_msg.finish("欢呼吧！")
 
 
-async def is_play(bot: Bot, event: Event, state: T_State) -> bool:
-    text = event.get_plaintext()
-    if not text or not text.endswith(SING_CMD):
+async def is_play(bot: Bot, event: GroupMessageEvent, state: T_State) -> bool:
+    features = MessageFeatures.of(event, state)
+    if not features.plain_text.endswith(SING_CMD):
         return False
 
-    for name, speaker in plugin_config.sing_speakers.items():
-        if not text.startswith(name):
-            continue
-        state["speaker"] = speaker
-        return True
-
-    return False
+    name = features.prefix("sing_speakers")
+    if name is None:
+        return False
+    state["speaker"] = plugin_config.sing_speakers[name]
+    return True
 
 
 play_cmd = on_message(
@@ -273,25 +270,20 @@ async def _(bot: Bot, event: GroupMessageEvent, state: T_State):
 async def is_to_request_song(event: GroupMessageEvent, state: T_State) -> bool:
     if not plugin_config.sing_enable:
         return False
-    text = event.get_plaintext()
+    features = MessageFeatures.of(event, state)
+    text = features.plain_text
     if not text:
         return False
 
-    if REQUEST_SONG_CMD not in text:
+    if REQUEST_SONG_CMD not in features.hits:
         return False
 
     if not text.endswith(REQUEST_SONG_CMD):
-        has_spk = False
-        for name, speaker in plugin_config.sing_speakers.items():
-            if not text.startswith(name):
-                continue
-            text = text.replace(name, "").strip()
-            has_spk = True
-            state["speaker"] = speaker
-            break
-
-        if not has_spk:
+        name = features.prefix("sing_speakers")
+        if name is None:
             return False
+        text = text.replace(name, "").strip()
+        state["speaker"] = plugin_config.sing_speakers[name]
 
         if text.startswith(REQUEST_SONG_CMD):
             song_name = text.replace(REQUEST_SONG_CMD, "").strip()
@@ -354,9 +346,9 @@ async def _(bot: Bot, event: GroupMessageEvent, state: T_State):
     await sing_msg.finish("欢呼吧！")
 
 
-async def what_song(event: Event) -> bool:
-    text = event.get_plaintext()
-    return any(text.startswith(spk) for spk in SPEAKERS) and any(key in text for key in WHAT_SONG_CMDS)
+async def what_song(event: GroupMessageEvent, state: T_State) -> bool:
+    features = MessageFeatures.of(event, state)
+    return features.prefix("sing_speakers") is not None and not features.hits.isdisjoint(WHAT_SONG_CMDS)
 
 
 song_title_cmd = on_message(
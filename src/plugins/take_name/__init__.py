@@ -72,8 +72,9 @@ async def change_name():
         target_user_id = target_msg.user_id
         logger.info(f"bot [{bot_id}] ready to change name by using [{target_user_id}] in group [{group_id}]")
 
-        bot = get_bot(str(bot_id))
-        if not bot:
+        try:
+            bot = get_bot(str(bot_id))
+        except KeyError:
             logger.error("no bot: " + str(bot_id))
             continue
 
@@ -0,0 +1,44 @@
+# 对比消息规范化原来的写法（每个地方各自跑正则、子串查找）和 src/common/utils/cqcode.py 的单次解析
+# 用法: python tools/bench_cqcode.py [每组消息的执行次数]
+
+import re
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.common.utils.cqcode import parse_cqcode  # noqa: E402
+
+number = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+samples = {
+    "纯文本": "牛牛今天吃什么",
+    "长文本": "今天的会议改到下午三点，大家记得带上电脑和上周的报告，" * 8,
+    "图片": "[CQ:image,file=3f0a1b2c3d4e5f60718293a4b5c6d7e8.image,subType=1,url=https://example.com/a?b=c&amp;d=e]",
+    "回复+at": "[CQ:reply,id=-2147483648][CQ:at,qq=123456789] 说得对",
+    "混合": "看这个[CQ:face,id=178][CQ:image,file=0a1b2c3d.image,subType=0]哈哈哈[CQ:at,qq=10001]",
+}
+
+
+def old(raw: str) -> tuple:
+    # Chat.__init__ 规范化，ChatData 里的各个特征，_context_insert 判断回复
+    raw = re.sub(r"\.image,.+?\]", ".image]", raw)
+    is_plain_text = "[CQ:" not in raw and len(raw) != 0
+    is_image = "[CQ:image," in raw or "[CQ:face," in raw
+    has_reply = "[CQ:reply," in raw
+    has_at = "[CQ:at," in raw
+    return raw, is_plain_text, is_image, has_reply, has_at
+
+
+def new(raw: str) -> tuple:
+    cq = parse_cqcode(raw)
+    return cq.raw, cq.is_plain_text, cq.is_image, cq.has_reply, cq.has_at
+
+
+print(f"{'消息':<8}{'原来 (us)':>12}{'现在 (us)':>12}")
+for name, raw in samples.items():
+    assert old(raw) == new(raw), name
+    old_time = timeit.timeit(lambda raw=raw: old(raw), number=number) / number * 1e6
+    new_time = timeit.timeit(lambda raw=raw: new(raw), number=number) / number * 1e6
+    print(f"{name:<8}{old_time:>12.3f}{new_time:>12.3f}")
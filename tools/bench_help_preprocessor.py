@@ -0,0 +1,134 @@
+# 统计帮助插件的禁用检查在每条群消息上花掉的 CPU 时间：事件预处理一次，加上每个消息响应器执行前检查一次
+# 对比原来按事件记录禁用插件（_blocked_events）的写法和现在直接查禁用插件表的写法，禁用插件表提前加载好，不访问数据库
+# 直接调用预处理函数，不经过 NoneBot 的依赖注入，只看函数本身的开销
+# 用法: python tools/bench_help_preprocessor.py [消息条数]
+
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root))
+os.chdir(root)
+
+import nonebot  # noqa: E402
+from nonebot import logger  # noqa: E402
+from nonebot.adapters.onebot.v11 import Adapter, Bot, GroupMessageEvent, Message  # noqa: E402
+from nonebot.exception import IgnoredException  # noqa: E402
+
+nonebot.init(apscheduler_autostart=False)
+nonebot.get_driver().register_adapter(Adapter)
+nonebot.load_plugins("src/plugins")
+
+from nonebot.matcher import matchers  # noqa: E402
+
+from src.plugins.help import plugin_manager  # noqa: E402
+from src.plugins.help.event_preprocessor import (  # noqa: E402
+    IGNORED_PLUGINS,
+    block_disabled_plugins,
+    check_plugin_enabled,
+)
+from src.plugins.help.plugin_manager import get_disabled_plugins  # noqa: E402
+
+number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+BOT_ID = 10000
+GROUP_ID = 30000
+
+
+def make_event(message_id: int) -> GroupMessageEvent:
+    message = Message("今天的会议改到下午三点了")
+    return GroupMessageEvent(
+        time=int(time.time()),
+        self_id=BOT_ID,
+        post_type="message",
+        sub_type="normal",
+        user_id=20000,
+        message_type="group",
+        message_id=message_id,
+        message=message,
+        original_message=message,
+        raw_message=str(message),
+        font=0,
+        sender={"user_id": 20000},
+        group_id=GROUP_ID,
+        to_me=False,
+    )
+
+
+# 原来的写法：预处理时按事件记下禁用的插件，matcher 执行前按事件查
+_blocked_events: dict[str, frozenset[str]] = {}
+
+
+async def old_block_disabled_plugins(bot: Bot, event: GroupMessageEvent):
+    event_id = f"{bot.self_id}_{event.message_id}_{event.group_id}"
+    _blocked_events[event_id] = await get_disabled_plugins(int(bot.self_id), event.group_id)
+
+    if len(_blocked_events) > 10000:
+        keys = list(_blocked_events.keys())
+        for key in keys[:-1000]:
+            _blocked_events.pop(key, None)
+
+
+async def old_check_plugin_enabled(matcher, bot: Bot, event: GroupMessageEvent):
+    module_name = matcher.plugin_name
+    plugin_name = module_name or "unknown"
+    if module_name:
+        for part in reversed(module_name.split(".")):
+            if part != "__init__":
+                plugin_name = part
+                break
+
+    if plugin_name.lower() in IGNORED_PLUGINS:
+        return
+
+    event_id = f"{bot.self_id}_{event.message_id}_{event.group_id}"
+    disabled_plugins = _blocked_events.get(event_id)
+    if disabled_plugins is None:
+        disabled_plugins = await get_disabled_plugins(int(bot.self_id), event.group_id)
+
+    if plugin_name in disabled_plugins:
+        logger.debug(f"{plugin_name} 已禁用")
+        raise IgnoredException(f"Plugin {plugin_name} is disabled")
+
+
+async def run(preprocessor, checker, bot: Bot, message_matchers: list, events: list[GroupMessageEvent]) -> float:
+    start = time.perf_counter()
+    for event in events:
+        await preprocessor(bot, event)
+        for matcher in message_matchers:
+            try:
+                await checker(matcher, bot, event)
+            except IgnoredException:
+                pass
+    return (time.perf_counter() - start) / len(events) * 1e6
+
+
+async def main() -> None:
+    bot = Bot(nonebot.get_adapter(Adapter), str(BOT_ID))
+    # 和 NoneBot 一样，执行前检查拿到的是 matcher 的实例
+    message_matchers = [matcher() for group in matchers.values() for matcher in group if matcher.type == "message"]
+
+    # 禁用一个插件，检查时两种结果都会出现；表设为不过期
+    disabled = frozenset(sorted({m.plugin_name.split(".")[-1] for m in message_matchers if m.plugin_name})[:1])
+    plugin_manager._disabled_table[(BOT_ID, GROUP_ID)] = (float("inf"), disabled)
+
+    print(f"{len(message_matchers)} 个消息响应器，禁用 {', '.join(disabled)}")
+    # 交替各跑几遍取最快的一次，减少先后顺序和抖动的影响
+    costs: dict[str, float] = {}
+    for name, preprocessor, checker in (
+        ("原来", old_block_disabled_plugins, old_check_plugin_enabled),
+        ("现在", block_disabled_plugins, check_plugin_enabled),
+    ) * 3:
+        events = [make_event(message_id) for message_id in range(number)]
+        cost = await run(preprocessor, checker, bot, message_matchers, events)
+        costs[name] = min(cost, costs.get(name, cost))
+
+    print(f"{'写法':<8}{'每条消息 (us)':>14}")
+    for name, cost in costs.items():
+        print(f"{name:<8}{cost:>14.2f}")
+
+
+asyncio.run(main())
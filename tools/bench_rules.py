@@ -0,0 +1,152 @@
+# 统计一条群消息在所有消息响应器的 rule 上花掉的 CPU 时间，用来对比各个插件 rule 的改动前后
+# 分两列：只算 rule 函数本身（直接调用），以及经过 NoneBot 依赖注入调用的总时间（大部分是框架本身的开销）
+# 会加载 src/plugins 下的所有插件，缺依赖加载不了的插件跳过；需要访问数据库的 rule 第一次出错后就不再计入
+# 每条消息按同一个群里有两个牛牛账号处理：两个账号各收到一个事件，和适配器一样去掉 @ 自己的部分
+# 和 NoneBot 一样，每个事件先执行一次事件预处理，各响应器的 rule 拿到的是预处理后 state 的副本，预处理也计入时间
+# 用法: python tools/bench_rules.py [每条消息的执行次数]
+
+import asyncio
+import inspect
+import os
+import sys
+import time
+from pathlib import Path
+
+root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root))
+os.chdir(root)
+
+import nonebot  # noqa: E402
+from nonebot.adapters.onebot.v11 import Adapter, Bot, GroupMessageEvent, Message  # noqa: E402
+from nonebot.adapters.onebot.v11.bot import _check_at_me  # noqa: E402
+from nonebot.params import BotParam, EventParam, StateParam  # noqa: E402
+
+nonebot.init(apscheduler_autostart=False)
+nonebot.get_driver().register_adapter(Adapter)
+nonebot.load_plugins("src/plugins")
+
+from nonebot.matcher import matchers  # noqa: E402
+
+from src.common.utils.message_features import prepare_message_features  # noqa: E402
+
+number = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+samples = {
+    "闲聊": "今天的会议改到下午三点了",
+    "叫牛牛": "牛牛",
+    "牛牛喝酒": "牛牛喝酒",
+    "唱歌": "牛牛唱歌 春日影",
+    "图片": "[CQ:image,file=3f0a1b2c3d4e5f60718293a4b5c6d7e8.image,subType=1]",
+    "回复+at": "[CQ:reply,id=-2147483648][CQ:at,qq=123456789] 说得对",
+    "at牛牛喝酒": "[CQ:at,qq=10000] 牛牛喝酒",
+}
+
+BOT_IDS = (10000, 10001)
+
+message_id = 0
+
+
+def make_event(raw: str, self_id: int) -> GroupMessageEvent:
+    message = Message(raw)
+    return GroupMessageEvent(
+        time=int(time.time()),
+        self_id=self_id,
+        post_type="message",
+        sub_type="normal",
+        user_id=20000,
+        message_type="group",
+        message_id=message_id,
+        message=message,
+        original_message=message,
+        raw_message=raw,
+        font=0,
+        sender={"user_id": 20000},
+        group_id=30000,
+        to_me=False,
+    )
+
+
+def direct_call(matcher):
+    """
+    把响应器的各个 rule 函数做成直接调用，不经过依赖注入；用到 bot、event、state 以外参数的返回 None
+    """
+
+    names = {BotParam: "bot", EventParam: "event", StateParam: "state"}
+    calls = []
+    for checker in matcher.rule.checkers:
+        if checker.parameterless:
+            return None
+        params = {}
+        for param in checker.params:
+            name = names.get(type(param.field_info))
+            if name is None:
+                return None
+            params[param.name] = name
+        calls.append((checker.call, params))
+
+    async def check(bot: Bot, event: GroupMessageEvent, state: dict) -> None:
+        values = {"bot": bot, "event": event, "state": state}
+        for call, params in calls:
+            result = call(**{key: values[name] for key, name in params.items()})
+            if inspect.isawaitable(result):
+                await result
+
+    return check
+
+
+async def main() -> None:
+    global message_id
+    adapter = nonebot.get_adapter(Adapter)
+    bots = [Bot(adapter, str(bot_id)) for bot_id in BOT_IDS]
+    message_matchers = [matcher for group in matchers.values() for matcher in group if matcher.type == "message"]
+    direct_checks = {matcher: direct_call(matcher) for matcher in message_matchers}
+    broken: set = set()
+
+    print(f"{len(message_matchers)} 个消息响应器")
+    print(f"{'消息':<8}{'rule 函数 (us)':>16}{'含依赖注入 (us)':>18}")
+    for name, raw in samples.items():
+        events = []
+        for _ in range(number):
+            message_id += 1
+            for bot in bots:
+                event = make_event(raw, int(bot.self_id))
+                _check_at_me(bot, event)
+                events.append((bot, event))
+        direct_cost = 0.0
+        cost = 0.0
+        for bot, event in events:
+            # rule 函数本身，不经过依赖注入的部分
+            start = time.perf_counter()
+            state = {}
+            await prepare_message_features(event, state)
+            for matcher in message_matchers:
+                check = direct_checks[matcher]
+                if matcher in broken or check is None:
+                    continue
+                try:
+                    await check(bot, event, state.copy())
+                except Exception:
+                    broken.add(matcher)
+            direct_cost += time.perf_counter() - start
+
+            start = time.perf_counter()
+            state = {}
+            await prepare_message_features(event, state)
+            for matcher in message_matchers:
+                if matcher in broken:
+                    continue
+                try:
+                    await matcher.check_rule(bot, event, state.copy())
+                except Exception:
+                    broken.add(matcher)
+            cost += time.perf_counter() - start
+        print(f"{name:<8}{direct_cost / len(events) * 1e6:>16.1f}{cost / len(events) * 1e6:>18.1f}")
+
+    if broken:
+        print(f"跳过了 {len(broken)} 个出错的响应器: {', '.join(sorted(m.plugin_name or '' for m in broken))}")
+    skipped = sorted(m.plugin_name or "" for m, check in direct_checks.items() if check is None)
+    if skipped:
+        print(f"rule 函数一列不含这些用到其他参数的响应器: {', '.join(skipped)}")
+
+
+asyncio.run(main())
@@ -0,0 +1,63 @@
+# 给已有的 context 补上关键词拼音签名，配合复读插件的 FUZZY_CONTEXT=true 使用
+# 新学的 context 会自动带上拼音，只需要在开启模糊查找前执行一次；牛牛运行时也可以执行
+# 用法: python tools/index_context_pinyin.py [--all] [--collection 集合名] [mongo_host] [mongo_port]
+#   --all: 已经有拼音的也重新计算一遍，改了签名的算法之后用
+#   --collection: 要处理的 context 集合，默认 context，也可以是 tools/rebuild_context.py 重建出来的集合
+
+import sys
+from pathlib import Path
+
+import pymongo
+from pymongo import IndexModel, UpdateOne
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.common.utils.keywords import pinyin_signature, to_pinyin  # noqa: E402
+
+argv = sys.argv[1:]
+collection = "context"
+if "--collection" in argv:
+    index = argv.index("--collection")
+    collection = argv[index + 1]
+    del argv[index : index + 2]
+args = [arg for arg in argv if not arg.startswith("--")]
+rebuild_all = "--all" in argv
+host = args[0] if len(args) > 0 else "127.0.0.1"
+port = int(args[1]) if len(args) > 1 else 27017
+batch_size = 1000
+
+mongo_client = pymongo.MongoClient(host, port, unicode_decode_error_handler="ignore")
+
+mongo_db = mongo_client["PallasBot"]
+context_mongo = mongo_db[collection]
+
+context_mongo.create_indexes([
+    IndexModel(
+        [("pinyin", pymongo.ASCENDING), ("count", pymongo.DESCENDING)],
+        name="pinyin_index",
+        partialFilterExpression={"pinyin": {"$exists": True}},
+    )
+])
+
+query = {} if rebuild_all else {"pinyin": {"$exists": False}}
+ops = []
+index = 0
+skipped = 0
+
+for context in context_mongo.find(query, {"keywords": 1}):
+    keywords = context["keywords"]
+    index += 1
+    # 图片等非纯文本的 context 不参与模糊查找
+    if "[CQ:" in keywords:
+        skipped += 1
+        continue
+
+    ops.append(UpdateOne({"_id": context["_id"]}, {"$set": {"pinyin": pinyin_signature(to_pinyin(keywords))}}))
+    if len(ops) >= batch_size:
+        context_mongo.bulk_write(ops, ordered=False)
+        ops.clear()
+        print(index)
+
+if ops:
+    context_mongo.bulk_write(ops, ordered=False)
+print(f"done, {index - skipped} contexts indexed, {skipped} skipped")
@@ -0,0 +1,389 @@
+# 用 message 集合里存档的群消息，离线重新学习一遍 context
+# 改了 ChatData._keywords_size 或者分词词典之后，不用在线慢慢重新学，用这个重建
+# 按时间顺序回放每个群的消息，和复读插件的 learn 规则一致：学群里的上一条发言，以及同一个人倒序三句之内的上一条发言
+# 关键词用多进程重新提取，结果批量写进新的集合（默认 context_rebuild / answer_rebuild），不会动正在用的 context
+# 确认没问题后停掉牛牛，把新集合改名替换掉原来的集合再启动。原来 context 里的 ban 记录会复制过来
+# 中途停掉可以直接重新执行，会从上次写完的地方继续。进度在每批写完之后才保存，
+# 如果正好在写完一批、保存进度之前停掉，这一批会重新写一遍，其中的次数会多算一次（至少一次，不保证恰好一次）
+# 第一次执行会给 message 集合建一个 (time, _id) 索引，按这个顺序读才能边读边处理，不用先整体排序
+# --dry-run 不写数据库，也不建这个索引，没建过的话要等数据库先把整个集合排好序
+# 用法: python tools/rebuild_context.py [--dry-run] [--restart] [--split] [--workers N] [--keywords-size N]
+#                                       [--max-messages N] [--target 集合名] [mongo_host] [mongo_port]
+#   --dry-run: 只统计，不写数据库
+#   --restart: 忽略上次的进度，清空目标集合从头开始
+#   --split: 按复读插件 CONTEXT_STORAGE=split 的格式写，回复单独写到 --answer-target（默认 answer_rebuild）
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pymongo
+from bson import ObjectId
+from pymongo import IndexModel, UpdateOne
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.common.utils.keywords import extract_keywords  # noqa: E402
+
+CHECKPOINT = Path("data/repeater/rebuild_context_checkpoint.json")
+# 牛牛在用的集合，不能当目标集合
+LIVE_COLLECTIONS = {
+    "config",
+    "group_config",
+    "user_config",
+    "message",
+    "context",
+    "answer",
+    "blacklist",
+    "image_cache",
+}
+
+
+def extract_batch(texts: list[str], top_k: int) -> list[list[str]]:
+    return [extract_keywords(text, top_k)[0] for text in texts]
+
+
+class Rebuilder:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        mongo_db = pymongo.MongoClient(args.host, args.port, unicode_decode_error_handler="ignore")["PallasBot"]
+        self.message_mongo = mongo_db["message"]
+        self.live_context_mongo = mongo_db["context"]
+        self.context_mongo = mongo_db[args.target]
+        self.answer_mongo = mongo_db[args.answer_target] if args.split else None
+
+        # 群号 -> 最近三条学过的消息 (user_id, raw_message, keywords)
+        self.windows: defaultdict[int, deque[tuple[int, str, str]]] = defaultdict(lambda: deque(maxlen=3))
+        self.last: tuple[int, str] | None = None  # 上次写完的 (time, _id)
+
+        # 这一批还没写的学习结果
+        # context keywords -> [次数, 时间, {(群号, 回复 keywords): [次数, 时间, 消息, 纯文本消息]}]
+        self.pending: dict[str, list] = {}
+
+        self.stats = defaultdict(int)
+        self.contexts: set[str] = set()
+        self.answers: set[tuple[str, int, str]] = set()
+
+    def run(self) -> None:
+        if not self.args.dry_run:
+            self._prepare_target()
+            # 只有 time 的索引时，按 (time, _id) 排序要先在内存里把整个集合排好，数据多了会超出排序的内存限制
+            self.message_mongo.create_indexes([
+                IndexModel([("time", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)], name="time_id_index")
+            ])
+
+        query = {}
+        if self.last:
+            last_time, last_id = self.last
+            query = {"$or": [{"time": {"$gt": last_time}}, {"time": last_time, "_id": {"$gt": last_id}}]}
+            print(f"resume from time {last_time}")
+
+        cursor = (
+            self.message_mongo
+            .find(
+                query,
+                {
+                    "group_id": 1,
+                    "user_id": 1,
+                    "raw_message": 1,
+                    "is_plain_text": 1,
+                    "plain_text": 1,
+                    "keywords": 1,
+                    "time": 1,
+                },
+            )
+            .sort([("time", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)])
+            .batch_size(self.args.batch_size)
+        )
+
+        with ProcessPoolExecutor(self.args.workers) as executor:
+            batch = []
+            for doc in cursor:
+                batch.append(doc)
+                if len(batch) >= self.args.batch_size:
+                    self._process(batch, executor)
+                    batch = []
+            if batch:
+                self._process(batch, executor)
+
+        if not self.args.dry_run:
+            self._copy_bans()
+            CHECKPOINT.unlink(missing_ok=True)
+        self._report(final=True)
+
+    def _prepare_target(self) -> None:
+        targets = {self.args.target, self.args.answer_target} if self.args.split else {self.args.target}
+        if targets & LIVE_COLLECTIONS:
+            sys.exit(f"target collection must not be one of {sorted(LIVE_COLLECTIONS)}")
+
+        if self.args.restart or not CHECKPOINT.exists():
+            self.context_mongo.drop()
+            if self.answer_mongo is not None:
+                self.answer_mongo.drop()
+            CHECKPOINT.unlink(missing_ok=True)
+        else:
+            self._load_checkpoint()
+
+        self.context_mongo.create_indexes([IndexModel([("keywords", pymongo.HASHED)], name="keywords_index")])
+        if self.answer_mongo is not None:
+            self.answer_mongo.create_indexes([
+                IndexModel(
+                    [
+                        ("context_keywords", pymongo.ASCENDING),
+                        ("group_id", pymongo.ASCENDING),
+                        ("keywords", pymongo.ASCENDING),
+                    ],
+                    name="context_group_keywords_index",
+                    unique=True,
+                )
+            ])
+
+    def _process(self, batch: list[dict], executor: ProcessPoolExecutor) -> None:
+        # 相同的文本只提取一次，分成几块交给各个进程
+        texts = list({doc["plain_text"] for doc in batch if doc["plain_text"]})
+        chunk_size = max(1, len(texts) // (self.args.workers * 4) + 1)
+        chunks = [texts[i : i + chunk_size] for i in range(0, len(texts), chunk_size)]
+        keywords_of = {}
+        top_ks = [self.args.keywords_size] * len(chunks)
+        for chunk, results in zip(chunks, executor.map(extract_batch, chunks, top_ks), strict=True):
+            keywords_of.update(zip(chunk, results, strict=True))
+
+        for doc in batch:
+            self._learn(doc, keywords_of)
+
+        self.last = (batch[-1]["time"], batch[-1]["_id"])
+        if not self.args.dry_run:
+            # 写完再存进度，中间停掉的话这一批会重放，次数多算一次，见文件开头的说明
+            self._flush()
+            self._save_checkpoint()
+        self.pending.clear()
+        self._report()
+
+    def _learn(self, doc: dict, keywords_of: dict[str, list[str]]) -> None:
+        self.stats["messages"] += 1
+        raw_message = doc["raw_message"]
+        if len(raw_message.strip()) == 0:
+            return
+
+        # 和 ChatData.keywords 一致
+        plain_text = doc["plain_text"]
+        if len(plain_text) == 0:
+            keywords = raw_message
+        else:
+            keywords = " ".join(keywords_of[plain_text]) or plain_text
+        if keywords != doc["keywords"]:
+            self.stats["keywords_changed"] += 1
+
+        window = self.windows[doc["group_id"]]
+        if window:
+            pre_user_id, pre_raw, pre_keywords = window[-1]
+            self._context_insert(doc, keywords, pre_raw, pre_keywords)
+            if pre_user_id != doc["user_id"]:
+                for user_id, msg_raw, msg_keywords in list(window)[-2:][::-1]:
+                    if user_id == doc["user_id"]:
+                        self._context_insert(doc, keywords, msg_raw, msg_keywords)
+                        break
+
+        window.append((doc["user_id"], raw_message, keywords))
+
+    def _context_insert(self, doc: dict, keywords: str, pre_raw: str, pre_keywords: str) -> None:
+        raw_message = doc["raw_message"]
+        # 在复读，不学；回复别人的，不学
+        if pre_raw == raw_message or "[CQ:reply," in raw_message:
+            return
+
+        self.stats["learned"] += 1
+        group_id = doc["group_id"]
+        cur_time = doc["time"]
+        if self.args.dry_run:
+            self.contexts.add(pre_keywords)
+            self.answers.add((pre_keywords, group_id, keywords))
+            return
+
+        context = self.pending.get(pre_keywords)
+        if context is None:
+            context = self.pending[pre_keywords] = [0, 0, {}]
+        context[0] += 1
+        context[1] = cur_time
+
+        answer = context[2].get((group_id, keywords))
+        if answer is None:
+            answer = context[2][(group_id, keywords)] = [0, 0, [], []]
+        answer[0] += 1
+        answer[1] = cur_time
+
+        # 新学的回复总要记下第一条消息；已有的回复只记纯文本
+        is_plain_text = doc.get("is_plain_text", True)
+        if is_plain_text or not answer[2]:
+            if len(answer[2]) < self.args.max_messages:
+                answer[2].append(raw_message)
+        if is_plain_text and len(answer[3]) < self.args.max_messages:
+            answer[3].append(raw_message)
+
+    def _flush(self) -> None:
+        if self.args.split:
+            context_ops, answer_ops = self._build_split_ops()
+            self._bulk_write(self.context_mongo, context_ops)
+            self._bulk_write(self.answer_mongo, answer_ops)
+        else:
+            self._bulk_write(self.context_mongo, self._build_embedded_ops())
+
+    @staticmethod
+    def _bulk_write(collection, ops: list[UpdateOne]) -> None:
+        if ops:
+            # 同一个 context 的 upsert 必须在更新它之前执行，所以要按顺序写
+            collection.bulk_write(ops, ordered=True)
+
+    def _build_embedded_ops(self) -> list[UpdateOne]:
+        max_messages = self.args.max_messages
+        ops = []
+        for context_keywords, (_, _, answers) in self.pending.items():
+            ops.append(
+                UpdateOne(
+                    {"keywords": context_keywords},
+                    {"$setOnInsert": {"time": 0, "count": 0, "answers": [], "ban": [], "clear_time": 0}},
+                    upsert=True,
+                )
+            )
+            for (group_id, keywords), (count, answer_time, messages, plain_messages) in answers.items():
+                match = {"group_id": group_id, "keywords": keywords}
+                # 已经有这条回复了，原地累加，只追加纯文本消息
+                update = {
+                    "$inc": {"count": count, "answers.$.count": count},
+                    "$set": {"time": answer_time, "answers.$.time": answer_time},
+                }
+                if plain_messages:
+                    update["$push"] = {"answers.$.messages": {"$each": plain_messages, "$slice": max_messages}}
+                # 还没有这条回复，新建一条。两条的条件互斥，只有一边会生效
+                ops.extend((
+                    UpdateOne({"keywords": context_keywords, "answers": {"$elemMatch": match}}, update),
+                    UpdateOne(
+                        {"keywords": context_keywords, "answers": {"$not": {"$elemMatch": match}}},
+                        {
+                            "$inc": {"count": count},
+                            "$set": {"time": answer_time},
+                            "$push": {"answers": {**match, "count": count, "time": answer_time, "messages": messages}},
+                        },
+                    ),
+                ))
+        return ops
+
+    def _build_split_ops(self) -> tuple[list[UpdateOne], list[UpdateOne]]:
+        max_messages = self.args.max_messages
+        context_ops = []
+        answer_ops = []
+        for context_keywords, (count, context_time, answers) in self.pending.items():
+            context_ops.append(
+                UpdateOne(
+                    {"keywords": context_keywords},
+                    {
+                        "$inc": {"count": count},
+                        "$set": {"time": context_time},
+                        "$setOnInsert": {"answers": [], "ban": [], "clear_time": 0},
+                    },
+                    upsert=True,
+                )
+            )
+            for (group_id, keywords), (answer_count, answer_time, messages, plain_messages) in answers.items():
+                key = {"context_keywords": context_keywords, "group_id": group_id, "keywords": keywords}
+                # 已经有这条回复了，只追加纯文本消息；还没有的话新建一条，已有的文档不受 $setOnInsert 影响
+                answer_ops.extend((
+                    UpdateOne(
+                        {**key, "count": {"$gt": 0}},
+                        {
+                            "$inc": {"count": answer_count},
+                            "$set": {"time": answer_time},
+                            "$push": {"messages": {"$each": plain_messages, "$slice": max_messages}},
+                        },
+                    ),
+                    UpdateOne(
+                        key,
+                        {"$setOnInsert": {"count": answer_count, "time": answer_time, "messages": messages}},
+                        upsert=True,
+                    ),
+                ))
+        return context_ops, answer_ops
+
+    def _copy_bans(self) -> None:
+        ops = [
+            UpdateOne({"keywords": doc["keywords"]}, {"$set": {"ban": doc["ban"]}})
+            for doc in self.live_context_mongo.find({"ban.0": {"$exists": True}}, {"keywords": 1, "ban": 1})
+        ]
+        for i in range(0, len(ops), self.args.batch_size):
+            self.context_mongo.bulk_write(ops[i : i + self.args.batch_size], ordered=False)
+        print(f"{len(ops)} contexts' bans copied")
+
+    def _load_checkpoint(self) -> None:
+        try:
+            checkpoint = json.loads(CHECKPOINT.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        # 这些参数变了，接着写会和已经写进去的对不上
+        options = ("target", "answer_target", "split", "keywords_size", "max_messages")
+        changed = [option for option in options if checkpoint.get(option) != getattr(self.args, option)]
+        if changed:
+            sys.exit(f"checkpoint was made with other {', '.join(changed)}, use --restart")
+
+        self.last = (checkpoint["time"], ObjectId(checkpoint["id"]))
+        for group_id, window in checkpoint["windows"].items():
+            self.windows[int(group_id)].extend(tuple(msg) for msg in window)
+        self.stats.update(checkpoint["stats"])
+
+    def _save_checkpoint(self) -> None:
+        last_time, last_id = self.last  # type: ignore
+        CHECKPOINT.parent.mkdir(parents=True, exist_ok=True)
+        CHECKPOINT.write_text(
+            json.dumps(
+                {
+                    "target": self.args.target,
+                    "answer_target": self.args.answer_target,
+                    "split": self.args.split,
+                    "keywords_size": self.args.keywords_size,
+                    "max_messages": self.args.max_messages,
+                    "time": last_time,
+                    "id": str(last_id),
+                    "windows": {group_id: list(window) for group_id, window in self.windows.items()},
+                    "stats": self.stats,
+                },
+                ensure_ascii=False,
+            ),
+            encoding="utf-8",
+        )
+
+    def _report(self, final: bool = False) -> None:
+        stats = self.stats
+        line = f"{stats['messages']} messages, {stats['learned']} learned, {stats['keywords_changed']} keywords changed"
+        if self.args.dry_run:
+            line += f", {len(self.contexts)} contexts, {len(self.answers)} answers"
+        if final:
+            line = f"done, {line}"
+        print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="从 message 集合离线重建 context")
+    parser.add_argument("host", nargs="?", default="127.0.0.1")
+    parser.add_argument("port", nargs="?", type=int, default=27017)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--restart", action="store_true")
+    parser.add_argument("--split", action="store_true")
+    parser.add_argument("--target", default="context_rebuild")
+    parser.add_argument("--answer-target", default="answer_rebuild")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--keywords-size", type=int, default=2)
+    parser.add_argument("--max-messages", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    start = time.time()
+    Rebuilder(args).run()
+    print(f"cost {time.time() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# 把 context 里内嵌的回复迁移到单独的 answer 集合，配合复读插件的 CONTEXT_STORAGE=split 使用
+# 可以重复执行，已经迁移过的回复会被覆盖
+# 请先停掉牛牛再执行，迁移完成后再修改配置、启动
+# 用法: python tools/split_context_answers.py [--clear] [mongo_host] [mongo_port]
+#   --clear: 迁移后清空 context 里内嵌的回复，清空后就不能再切回 embedded 存储了
+
+import sys
+
+import pymongo
+from pymongo import IndexModel, UpdateOne
+
+args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+clear = "--clear" in sys.argv
+host = args[0] if len(args) > 0 else "127.0.0.1"
+port = int(args[1]) if len(args) > 1 else 27017
+batch_size = 1000
+
+mongo_client = pymongo.MongoClient(host, port, unicode_decode_error_handler="ignore")
+
+mongo_db = mongo_client["PallasBot"]
+context_mongo = mongo_db["context"]
+answer_mongo = mongo_db["answer"]
+
+answer_mongo.create_indexes([
+    IndexModel(
+        [("context_keywords", pymongo.ASCENDING), ("group_id", pymongo.ASCENDING), ("keywords", pymongo.ASCENDING)],
+        name="context_group_keywords_index",
+        unique=True,
+    )
+])
+
+answer_ops = []
+context_ops = []
+index = 0
+
+
+def write():
+    if answer_ops:
+        answer_mongo.bulk_write(answer_ops, ordered=False)
+        answer_ops.clear()
+    if context_ops:
+        context_mongo.bulk_write(context_ops, ordered=False)
+        context_ops.clear()
+
+
+for context in context_mongo.find({"answers.0": {"$exists": True}}, {"keywords": 1, "answers": 1}):
+    for answer in context["answers"]:
+        key = {"context_keywords": context["keywords"], "group_id": answer["group_id"], "keywords": answer["keywords"]}
+        answer_ops.append(
+            UpdateOne(
+                key,
+                {
+                    "$set": {
+                        "count": answer.get("count", 1),
+                        "time": answer.get("time", 0),
+                        "messages": answer.get("messages", []),
+                    }
+                },
+                upsert=True,
+            )
+        )
+    if clear:
+        context_ops.append(UpdateOne({"_id": context["_id"]}, {"$set": {"answers": []}}))
+    index += 1
+
+    if len(answer_ops) >= batch_size:
+        write()
+        print(index)
+
+write()
+print(f"done, {index} contexts migrated")
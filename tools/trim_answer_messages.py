@@ -0,0 +1,41 @@
+# 一次性把已有 context 里每条回复保存的消息裁剪到 ANSWER_MESSAGES_MAX_SIZE 条
+# 超出的部分随机保留，和复读插件运行时的蓄水池抽样结果分布一致
+# 会整体覆盖 answers 字段，请先停掉牛牛再执行
+# 用法: python tools/trim_answer_messages.py [max_size] [mongo_host] [mongo_port]
+
+import random
+import sys
+
+import pymongo
+from pymongo import UpdateOne
+
+max_size = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+host = sys.argv[2] if len(sys.argv) > 2 else "127.0.0.1"
+port = int(sys.argv[3]) if len(sys.argv) > 3 else 27017
+batch_size = 1000
+
+mongo_client = pymongo.MongoClient(host, port, unicode_decode_error_handler="ignore")
+
+context_mongo = mongo_client["PallasBot"]["context"]
+
+# 有任意一条回复的消息数超过 max_size
+query = {f"answers.messages.{max_size}": {"$exists": True}}
+
+ops = []
+index = 0
+for context in context_mongo.find(query, {"answers": 1}):
+    answers = context["answers"]
+    for answer in answers:
+        if len(answer["messages"]) > max_size:
+            answer["messages"] = random.sample(answer["messages"], max_size)
+    ops.append(UpdateOne({"_id": context["_id"]}, {"$set": {"answers": answers}}))
+    index += 1
+
+    if len(ops) >= batch_size:
+        context_mongo.bulk_write(ops, ordered=False)
+        ops = []
+        print(index)
+
+if ops:
+    context_mongo.bulk_write(ops, ordered=False)
+print(f"done, {index} contexts trimmed")